@@ -0,0 +1,286 @@
+''' asyncio counterpart of the aptly backends
+
+Commands run as asyncio subprocesses and API requests go through aiohttp
+(optional: without it requests are executed by the synchronous backend in
+a worker thread). Many operations can be in flight on one thread; the
+number of concurrent operations is limited.
+'''
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import subprocess
+from typing import List
+
+import requests
+try:
+    import aiohttp
+except ImportError:  # optional dependency
+    aiohttp = None
+
+# errors of API requests (aiohttp or the synchronous fallback)
+REQUEST_ERRORS = (requests.RequestException,)
+if aiohttp is not None:
+    REQUEST_ERRORS += (aiohttp.ClientError,)
+
+from reptly import trace
+from reptly.aptly import AptlyApi, api_mirror_state, api_prefix, \
+    mirror_show_state, parse_download_size, parse_mirror_url, \
+    parse_task_output, task_run
+from reptly.server import UnixAdapter
+
+
+async def in_thread(func, *args, **kwargs):
+    ''' Run a blocking function (e.g. a question to the user) in a worker
+        thread within the current context (trace phase)
+    '''
+    call = functools.partial(contextvars.copy_context().run, func,
+                             *args, **kwargs)
+    return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+class AsyncHostLimiter():
+    ''' Limit the number of concurrent operations per upstream host '''
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.slots = {}
+
+    def __call__(self, host):
+        if host is None:  # e.g. local repos
+            return asyncio.Semaphore(1 << 30)
+        if host not in self.slots:
+            self.slots[host] = asyncio.BoundedSemaphore(self.limit)
+        return self.slots[host]
+
+
+class AsyncAptly():
+    ''' Awaitable versions of the changing operations of an Aptly backend
+
+        The wrapped (synchronous) backend keeps the lists, caches and
+        indexes; its other operations can be run in worker threads via
+        `call`. Commands are serialized with the commands of the wrapped
+        backend. Create it within the running event loop.
+    '''
+    def __init__(self, aptly, *, jobs: int = 8, unix_socket: str = None):
+        self.aptly = aptly
+        self.limit = asyncio.Semaphore(jobs)
+        # aptly locks its database: serialize commands like Aptly.run
+        self.lock = asyncio.Lock()
+        if unix_socket is None:
+            # reuse the unix socket of a managed API server (--serve)
+            session = getattr(aptly, 'session', None)
+            for adapter in getattr(session, 'adapters', {}).values():
+                if isinstance(adapter, UnixAdapter):
+                    unix_socket = adapter.socket_path
+        self.unix_socket = unix_socket
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @property
+    def api(self):
+        return isinstance(self.aptly, AptlyApi)
+
+    async def execute(self, *args, stdout=subprocess.DEVNULL, stderr=None,
+                      check: bool = True):
+        args = ['aptly'] + [arg for arg in args if arg]
+        async with self.limit:
+            with trace.span('command', trace.command_name(args[1:]),
+                            args[1:]) as record:
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdout=stdout, stderr=stderr)
+                out, err = await process.communicate()
+                record.status = process.returncode
+                record.size = len(out or b'') + len(err or b'')
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args,
+                                                out, err)
+        return subprocess.CompletedProcess(args, process.returncode, out, err)
+
+    @contextlib.asynccontextmanager
+    async def command_lock(self):
+        ''' Hold the command lock shared with the wrapped backend: its
+            operations may run aptly in worker threads meanwhile
+        '''
+        async with self.lock:
+            if not self.aptly.lock.acquire(blocking=False):
+                acquired = asyncio.ensure_future(
+                    in_thread(self.aptly.lock.acquire))
+                try:
+                    await asyncio.shield(acquired)
+                except asyncio.CancelledError:
+                    acquired.add_done_callback(
+                        lambda _: self.aptly.lock.release())
+                    raise
+            try:
+                yield
+            finally:
+                self.aptly.lock.release()
+
+    async def run(self, *args, **kwargs):
+        async with self.command_lock():
+            return await self.execute(*args, **kwargs)
+
+    async def call(self, func, *args, **kwargs):
+        ''' Run a synchronous operation of the backend (e.g. comparing
+            snapshots) in a worker thread; its aptly commands take the
+            shared command lock themselves.
+        '''
+        async with self.limit:
+            return await in_thread(func, *args, **kwargs)
+
+    async def request(self, method: str, path: str, **kwargs):
+        if aiohttp is None:
+            return await asyncio.get_event_loop().run_in_executor(
+                None, functools.partial(self.aptly.request, method, path,
+                                        **kwargs))
+        if self.session is None:
+            connector = None
+            if self.unix_socket:
+                connector = aiohttp.UnixConnector(path=self.unix_socket)
+            self.session = aiohttp.ClientSession(connector=connector)
+        async with self.limit:
+            with trace.span('http', f'{method} /api/{path}') as record:
+                async with self.session.request(
+                        method, self.aptly.url + '/api/' + path,
+                        **kwargs) as r:
+                    content = await r.read()
+                    record.status = r.status
+                    record.size = len(content)
+                    r.raise_for_status()
+        return json.loads(content.decode('utf-8')) if content else None
+
+    async def mirror_update(self, name: str):
+        ''' Update the mirror without progress output (see
+            Aptly.mirror_update); not serialized with other commands.
+            Returns the downloaded bytes.
+        '''
+        result = await self.execute('mirror', 'update',
+                                    '-keyring=aptlykeys.gpg'
+                                    if self.aptly.keyring else None,
+                                    name, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        return parse_download_size(result.stdout.decode('utf-8', 'replace'))
+
+    async def mirror_show(self, name: str):
+        if self.api:
+            return await self.request('GET', f'mirrors/{name}')
+        result = await self.run('mirror', 'show', name,
+                                stdout=subprocess.PIPE)
+        return result.stdout.decode('utf-8')
+
+    async def mirror_url(self, name: str):
+        info = await self.mirror_show(name)
+        return info['ArchiveRoot'] if self.api else parse_mirror_url(info)
+
+    async def mirror_state(self, name: str):
+        ''' See Aptly.mirror_state '''
+        info = await self.mirror_show(name)
+        return api_mirror_state(info) if self.api \
+            else mirror_show_state(info)
+
+    async def snapshot_mirror(self, snapshot: str, mirror: str):
+        await self._snapshot_create(snapshot, 'mirror', mirror)
+
+    async def snapshot_repo(self, snapshot: str, repo: str):
+        await self._snapshot_create(snapshot, 'repo', repo)
+
+    async def _snapshot_create(self, snapshot: str, type: str, source: str):
+        if self.api:
+            path = {'mirror': 'mirrors', 'repo': 'repos'}[type]
+            await self.request('POST', f'{path}/{source}/snapshots',
+                               json={'Name': snapshot})
+            self.aptly._snapshot_created(snapshot, [(type, source)])
+            return
+        commands = [['snapshot', 'create', snapshot, 'from', type, source],
+                    ['snapshot', 'show', '-with-packages', snapshot]]
+        with task_run(commands) as args:
+            result = await self.run(*args, stdout=subprocess.PIPE,
+                                    check=False)
+        self.aptly._snapshot_create_done(
+            snapshot, type, source,
+            *parse_task_output(commands, result.stdout.decode('utf-8'),
+                               result.returncode))
+
+    async def snapshot_merge(self, name, sources, *, latest=False):
+        if self.api:
+            params = {'latest': '1'} if latest is True else {}
+            await self.request('POST', 'snapshots/merge', params=params,
+                               json={'Destination': name,
+                                     'Sources': list(sources)})
+        else:
+            await self.run('snapshot', 'merge',
+                           '-latest' if latest is True else None,
+                           name, *sources)
+        self.aptly._snapshot_merged(name, sources, latest)
+
+    async def snapshot_drop(self, name: str, check: bool = True):
+        if self.api:
+            try:
+                await self.request('DELETE', f'snapshots/{name}')
+            except REQUEST_ERRORS:
+                if check:
+                    raise
+                return False
+        else:
+            result = await self.run('snapshot', 'drop', name, check=check)
+            if result.returncode != 0:
+                return False
+        self.aptly._snapshot_dropped(name)
+        return True
+
+    async def publish(self, distro: str, target: str, content: dict, *,
+                      architectures: List[str] = None,
+                      acquire_by_hash: bool = True):
+        if self.api:
+            publication = await self.request(
+                'POST', 'publish/' + api_prefix(target), json={
+                    'SourceKind': 'snapshot',
+                    'Sources': [{'Component': component, 'Name': snapshot}
+                                for component, snapshot in content.items()],
+                    'Distribution': distro,
+                    'Architectures': architectures or [],
+                    'AcquireByHash': acquire_by_hash,
+                })
+            await self._published(target, distro, publication)
+            return
+        await self.run('publish', 'snapshot',
+                       '-component=' + ','.join(content),
+                       '-architectures=' + ','.join(architectures)
+                       if architectures else None,
+                       '-distribution=' + distro,
+                       '-acquire-by-hash' if acquire_by_hash else None,
+                       *content.values(), target, stdout=None)
+        await self._published(target, distro)
+
+    async def switch_components(self, distro, target, changes):
+        if self.api:
+            publication = await self.request(
+                'PUT', f'publish/{api_prefix(target)}/{distro}', json={
+                    'Snapshots': [{'Component': component, 'Name': snapshot}
+                                  for component, snapshot in changes.items()],
+                })
+            await self._published(target, distro, publication)
+            return
+        await self.run('publish', 'switch',
+                       '-component=' + ','.join(changes.keys()),
+                       distro, target, *changes.values(), stdout=None)
+        await self._published(target, distro)
+
+    async def _published(self, target, distro, publication=None):
+        if self.aptly._publications is None:
+            return
+        if publication is None:
+            await self.call(self.aptly.refresh_publication, target, distro)
+        else:
+            self.aptly._store_publication(publication)
@@ -1,11 +1,18 @@
 #!/usr/bin/python3.8
+import asyncio
 import fnmatch
 import functools
+import subprocess
 import typing
 
 import yaml
 
+from reptly import trace
+from reptly.aio import REQUEST_ERRORS, AsyncAptly, AsyncHostLimiter
 from reptly.domain import Publish, Merge, Mirror, Repo, FixSnapshot
+from reptly.gc import GarbageCollector
+from reptly.parallel import DeferredOutput, Graph, HostLimiter, \
+    run_parallel
 
 
 class ConfigLoader(yaml.Loader):
@@ -28,41 +35,231 @@ for cls in [Mirror, Repo, FixSnapshot]:
         functools.partial(construct_scalar_type, cls))
 ConfigLoader.add_constructor('!snapshot.merge', construct_merge)
 
+# errors of a single source update (aptly command or API request)
+UPDATE_ERRORS = (subprocess.CalledProcessError,) + REQUEST_ERRORS
+
+# policies to order the source updates
+ORDERS = ('config', 'shortest', 'longest', 'priority')
+
 
 class App():
     def __init__(self, aptly, ui):
         self.aptly = aptly
         self.ui = ui
         self.publications = []
+        self.gc = {}
+        # result of every updated source (for metrics)
+        self.updates = {}
+        self.linked = set()  # mirrors, repos and merges linked to aptly
+        self.order = 'config'
+        self.priorities = {}
+        # expected update duration per source name: read from the run
+        # history (if any) when an order needs it
+        self.expected = None
+        self.history = None
+
+    def load(self, conf: typing.TextIO, args=None):
+        ''' Read the config and link the publications and sources the
+            action of args operates on (all without args)
+        '''
+        with trace.phase('load'):
+            self._load(conf)
+        publications, sources = self._selected(args)
+        with trace.phase('link'):
+            self.link(publications, sources)
 
-    def load(self, conf: typing.TextIO):
+    def _load(self, conf: typing.TextIO):
         data = yaml.load(conf, Loader=ConfigLoader)
 
         if data.get('keyring'):
             self.aptly.keyring = data['keyring']
+        self.gc = data.get('gc', {})
+        update = data.get('update', {})
+        self.order = update.get('order', 'config')
+        assert self.order in ORDERS, f'unknown update order {self.order}'
+        self.priorities = update.get('priority', {})
 
         for pub in data['publish']:
             prefix = pub.pop('destination')
             dist = pub.pop('distribution')
             self.publications.append(Publish(prefix, dist, pub))
 
-        for p in self.publications:
+    def _selected(self, args):
+        ''' Publications and (further) sources used by the action '''
+        action = getattr(args, 'action', None)
+        if action == 'update':
+            return [], self._update_targets(args)
+        if action in ('publish', 'run'):
+            filter = args.target or ['*']
+            return [p for p in self.publications
+                    if any(fnmatch.fnmatch(p.alias, f) for f in filter)], []
+        return self.publications, []
+
+    def link(self, publications, sources=()):
+        ''' Link publications and sources to aptly; the aptly lists needed
+            for them are loaded at once
+        '''
+        extra = list(sources)
+        sources = extra + [source for p in publications
+                           for source in p.components.values()]
+        leaves = list(self._leaf_sources(sources))
+        needed = []
+        if any(type(source) is Mirror for source in leaves):
+            needed.append('mirror')
+        if any(type(source) is Repo for source in leaves):
+            needed.append('repo')
+        if leaves or any(type(source) is Merge for source in sources):
+            needed.append('snapshot')
+        self.aptly.prefetch(*needed)
+
+        for p in publications:
             p.link(self)
+        for source in extra:
+            source.link(self)
+        self.linked.update(leaves)
+        self.linked.update(source for source in sources
+                           if type(source) is Merge)
 
-    def exec_update(self, args):
+    def _update_targets(self, args):
         filter = args.target or ['*']
 
-        for obj in list(Mirror.mirrors.values()) + list(Repo.repos.values()):
-            if not any(fnmatch.fnmatch(obj.name, f) for f in filter):
-                continue
-            update = obj.update(args)
-            if update:
-                if args.cron:
-                    print(obj.name)
-                    print('-'*len(obj.name))
+        return self._ordered([
+            obj
+            for obj in list(Mirror.mirrors.values()) + list(Repo.repos.values())
+            if any(fnmatch.fnmatch(obj.name, f) for f in filter)
+        ], args)
+
+    def _ordered(self, sources, args):
+        ''' Sources in the order to start their updates:
+
+            config: as defined
+            shortest: shortest expected duration first (feedback on most
+                sources early)
+            longest: longest expected duration first (shortest total
+                duration of parallel updates)
+            priority: highest `update: priority:` of the config first
+
+            Sources without expected duration count as the longest ones
+            (e.g. the initial download of a new mirror).
+        '''
+        order = args.order or self.order
+        inf = float('inf')
+        if order == 'shortest':
+            expected = self._expected_durations()
+            return sorted(sources, key=lambda s: expected.get(s.name, inf))
+        if order == 'longest':
+            expected = self._expected_durations()
+            return sorted(sources, key=lambda s: -expected.get(s.name, inf))
+        if order == 'priority':
+            return sorted(sources,
+                          key=lambda s: -self.priorities.get(s.name, 0))
+        return list(sources)
+
+    def _expected_durations(self):
+        if self.expected is None:
+            self.expected = self.history.expected_durations() \
+                if self.history else {}
+        return self.expected
+
+    def _leaf_sources(self, sources):
+        ''' Updatable sources (mirrors and repos, also within merges) '''
+        for source in sources:
+            if type(source) is Merge:
+                yield from self._leaf_sources(source.sources)
+            elif type(source) is not FixSnapshot:
+                yield source
+
+    def _run_targets(self, args):
+        ''' Publications to run and their sources in update order '''
+        filter = args.target or ['*']
+        publications = [p for p in self.publications
+                        if any(fnmatch.fnmatch(p.alias, f) for f in filter)]
+        sources = []
+        for p in publications:
+            for source in self._leaf_sources(p.components.values()):
+                if source not in sources:
+                    sources.append(source)
+        return publications, self._ordered(sources, args)
+
+    def exec_update(self, args):
+        objs = self._update_targets(args)
+        if args.jobs > 1:
+            return self._update_parallel(objs, args)
+        for obj in objs:
+            with trace.phase('update', obj.name):
+                update = obj.update(args)
+            self._print_update(obj, update, args)
+
+    def _print_update(self, obj, update, args):
+        self.updates[obj] = update
+        if update:
+            if args.cron or args.jobs > 1:
+                print(obj.name)
+                print('-'*len(obj.name))
+            else:
+                print()
+            print(update.diff)
+
+    def _update_parallel(self, objs, args):
+        limit = HostLimiter(args.jobs_per_host)
+
+        def update(obj):
+            with limit(obj.host), trace.phase('update', obj.name):
+                return obj.update(args)
+
+        errors = []
+        # print every result as one block once the source is done
+        for obj, result in run_parallel(update, objs, args.jobs):
+            try:
+                self._print_update(obj, result.result(), args)
+            except UPDATE_ERRORS as e:
+                self._print_failure(obj, e)
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def _print_failure(self, obj, e):
+        print(self._failure(obj, e))
+
+    def _failure(self, obj, e):
+        ''' Report of a failed update '''
+        lines = [obj.name, '-'*len(obj.name), f'Update failed: {e}']
+        details = getattr(e, 'stderr', None)
+        response = getattr(e, 'response', None)
+        if response is not None:
+            details = response.content
+        if details:
+            lines.append(details.decode('utf-8', 'replace'))
+        return '\n'.join(lines)
+
+    async def aexec_update(self, args):
+        ''' exec_update on an event loop: up to args.jobs aptly
+            operations are in flight at once
+        '''
+        async with AsyncAptly(self.aptly, jobs=args.jobs) as aio:
+            limit = AsyncHostLimiter(args.jobs_per_host)
+
+            async def update(obj):
+                try:
+                    async with limit(await obj.host_async(aio)):
+                        with trace.phase('update', obj.name):
+                            update = await obj.update_async(args, aio)
+                        return obj, update, None
+                except UPDATE_ERRORS as e:
+                    return obj, None, e
+
+            errors = []
+            tasks = [update(obj) for obj in self._update_targets(args)]
+            # print every result as one block once the source is done
+            for task in asyncio.as_completed(tasks):
+                obj, result, error = await task
+                if error:
+                    self._print_failure(obj, error)
+                    errors.append(error)
                 else:
-                    print()
-                print(update.diff)
+                    self._print_update(obj, result, args)
+            if errors:
+                raise errors[0]
 
     def exec_publish(self, args):
         filter = args.target or ['*']
@@ -70,15 +267,135 @@ class App():
         for p in self.publications:
             if not any(fnmatch.fnmatch(p.alias, f) for f in filter):
                 continue
-            p.publish(args)
+            with trace.phase('publish', p.alias):
+                p.publish(args)
+
+    def exec_gc(self, args):
+        collector = GarbageCollector(self, self.gc)
+        collector.collect(args.target or ['*'], dry_run=args.dry_run)
 
     def exec_run(self, args):
-        filter = args.target or ['*']
+        # Every source is a node of the graph (shared sources are
+        # updated only once); publications start as soon as their
+        # own sources are updated. Updates start in the configured
+        # order, every publication is added right after its last source.
+        publications, sources = self._run_targets(args)
+        graph = Graph()
+        limit = HostLimiter(args.jobs_per_host)
+        # update results wait for the questions of a publication
+        output = DeferredOutput()
 
-        for p in self.publications:
-            if not any(fnmatch.fnmatch(p.alias, f) for f in filter):
-                continue
-            for update in p.update_all(args):
-                print(update)
-                print(update.diff)
-            p.publish(args)
+        def add_ready_publications():
+            for p in publications:
+                if p in graph or not all(
+                        s in graph
+                        for s in self._leaf_sources(p.components.values())):
+                    continue
+                for source in p.components.values():
+                    self._add_update_node(graph, source, args, limit, output)
+                graph.add(p, functools.partial(self._run_publish, p, args,
+                                               output),
+                          p.components.values())
+
+        add_ready_publications()
+        for source in sources:
+            self._add_update_node(graph, source, args, limit, output)
+            add_ready_publications()
+        try:
+            graph.run(args.jobs)
+        finally:
+            output.flush()
+
+    def _add_update_node(self, graph, source, args, limit, output):
+        if source in graph:
+            return
+        if type(source) is Merge:
+            for s in source.sources:
+                self._add_update_node(graph, s, args, limit, output)
+            graph.add(source, None, source.sources)
+        elif type(source) is not FixSnapshot:
+            graph.add(source, functools.partial(
+                self._run_update, source, args, limit, output))
+
+    def _run_update(self, source, args, limit, output):
+        try:
+            # the host of a mirror is only needed to limit parallel updates
+            host = source.host if args.jobs > 1 else None
+            with limit(host), trace.phase('update', source.name):
+                update = source.update(args)
+        except UPDATE_ERRORS as e:
+            output.write(self._failure(source, e))
+            raise
+        self.updates[source] = update
+        if update:
+            output.write(f'{source.name}\n{"-"*len(source.name)}\n'
+                         f'{update.diff}')
+
+    def _run_publish(self, publication, args, output):
+        with output.dialog(), trace.phase('publish', publication.alias):
+            publication.publish(args)
+
+    async def aexec_run(self, args):
+        ''' exec_run on an event loop: sources are updated concurrently
+            (shared ones once), each publication as soon as its sources
+            are done
+        '''
+        publications, ordered = self._run_targets(args)
+
+        async with AsyncAptly(self.aptly, jobs=args.jobs) as aio:
+            limit = AsyncHostLimiter(args.jobs_per_host)
+            lock = asyncio.Lock()  # serializes output and questions
+            updates = {}
+            for source in ordered:  # start the updates in order
+                self._schedule_update(updates, source, args, aio, limit,
+                                      lock)
+            publishes = []
+            for p in publications:
+                sources = [self._schedule_update(updates, source, args,
+                                                 aio, limit, lock)
+                           for source in p.components.values()]
+                publishes.append(self._arun_publish(p, sources, args, aio,
+                                                    lock))
+            results = await asyncio.gather(*publishes,
+                                           return_exceptions=True)
+            # wait for updates not needed by any started publication
+            await asyncio.gather(*updates.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def _schedule_update(self, updates, source, args, aio, limit, lock):
+        if source in updates:
+            return updates[source]
+        if type(source) is Merge:
+            task = asyncio.gather(*[
+                self._schedule_update(updates, s, args, aio, limit, lock)
+                for s in source.sources])
+        elif type(source) is FixSnapshot:
+            task = asyncio.gather()
+        else:
+            task = asyncio.ensure_future(
+                self._arun_update(source, args, aio, limit, lock))
+        updates[source] = task
+        return task
+
+    async def _arun_update(self, source, args, aio, limit, lock):
+        try:
+            async with limit(await source.host_async(aio)):
+                with trace.phase('update', source.name):
+                    update = await source.update_async(args, aio)
+        except UPDATE_ERRORS as e:
+            async with lock:  # not within the questions of a publication
+                self._print_failure(source, e)
+            raise
+        self.updates[source] = update
+        if update:
+            async with lock:
+                print(f'{source.name}\n{"-"*len(source.name)}\n'
+                      f'{update.diff}')
+
+    async def _arun_publish(self, publication, sources, args, aio, lock):
+        await asyncio.gather(*sources)
+        async with lock:
+            with trace.phase('publish', publication.alias):
+                await publication.publish_async(args, aio)
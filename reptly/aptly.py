@@ -1,21 +1,348 @@
 #!/usr/bin/python3
+import bisect
+import collections
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import json
+import re
 import requests
 import subprocess
+import tempfile
+import threading
 
 from typing import List
 
+from reptly import trace
+from reptly.cache import fingerprint
+from reptly.diff import diff_packages, format_diff, merge_packages
+
+
+def parse_time(value: str):
+    ''' Parse timestamps of aptly (local time; sub-seconds and time zone
+        are ignored): "2019-03-06 10:00:00 CET" or
+        "2019-03-06T10:00:00.123456789+01:00"
+    '''
+    return datetime.datetime.strptime(value[:19].replace('T', ' '),
+                                      '%Y-%m-%d %H:%M:%S')
+
+
+def split_revision(name: str):
+    ''' Split a `<base>+rN` snapshot name into (base, N) - or None '''
+    base, sep, rev = name.rpartition('+r')
+    if not sep or not rev.isdigit():
+        return None
+    return base, int(rev)
+
+
+class SnapshotIndex():
+    ''' Revisions of all `<base>+rN` snapshots grouped by base name '''
+    def __init__(self, snapshots):
+        self.revisions = collections.defaultdict(list)
+        for name in snapshots:
+            split = split_revision(name)
+            if split:
+                self.revisions[split[0]].append(split[1])
+        for revisions in self.revisions.values():
+            revisions.sort()
+
+    def get(self, base: str):
+        return self.revisions.get(base, [])
+
+    def add(self, name: str):
+        split = split_revision(name)
+        if split:
+            bisect.insort(self.revisions[split[0]], split[1])
+
+    def remove(self, name: str):
+        split = split_revision(name)
+        if split and split[1] in self.revisions.get(split[0], []):
+            self.revisions[split[0]].remove(split[1])
+
+
+def parse_download_size(output: str):
+    ''' Bytes to download announced by `aptly mirror update`
+        ("Download queue: 25 items (31.45 MiB)")
+    '''
+    match = re.search(r'Download queue: \d+ items \(([0-9.]+) '
+                      r'(B|KiB|MiB|GiB|TiB)\)', output)
+    if not match:
+        return 0
+    units = ['B', 'KiB', 'MiB', 'GiB', 'TiB']
+    return int(float(match.group(1)) * 1024 ** units.index(match.group(2)))
+
+
+def parse_snapshot_description(description: str):
+    ''' Derive the snapshot sources from the description aptly
+        generates for created snapshots.
+    '''
+    if description.startswith('Merged from sources: '):
+        for name in re.findall(r"'([^']*)'", description):
+            yield 'snapshot', name
+        return
+    match = re.match(r'Snapshot from (mirror|local repo) \[([^\]]*)\]',
+                     description)
+    if match:
+        yield 'mirror' if match.group(1) == 'mirror' else 'repo', match.group(2)
+
+
+SnapshotMeta = collections.namedtuple(
+    'SnapshotMeta', ('name', 'description', 'created', 'sources'))
+
+
+def parse_snapshot_show(info: str):
+    ''' Extract the SnapshotMeta from the output of `aptly snapshot show` '''
+    fields = {}
+    sources = []
+    lines = info.split('\n')
+    types = {
+        'snapshot': ' [snapshot]',
+        'mirror': ' [repo]',
+        'repo': ' [local]',
+    }
+    for index, line in enumerate(lines):
+        if line == 'Sources:':
+            break
+        key, sep, value = line.partition(': ')
+        if sep:
+            fields[key] = value
+    else:
+        index = len(lines)
+    for line in lines[index + 1:]:
+        if not line.startswith('  '):
+            break
+        for label, suffix in types.items():
+            if not line.endswith(suffix):
+                continue
+            sources.append((label, line[2:].rsplit(' ', 1)[0]))
+            break
+        else:
+            print(f'Ignore unknown snapshot source: {line} '
+                  f'in ({fields.get("Name")})')
+    return SnapshotMeta(fields.get('Name'), fields.get('Description', ''),
+                        parse_time(fields['Created At']), tuple(sources))
+
+
+def parse_snapshot_packages(info: str):
+    ''' Extract the sorted (name, version, architecture) list from the
+        output of `aptly snapshot show -with-packages`
+    '''
+    info = info.split('\n')
+    if 'Packages:' not in info:
+        return []
+    packages = []
+    for line in info[info.index('Packages:') + 1:]:
+        if not line.startswith('  '):
+            break
+        packages.append(tuple(line.strip().rsplit('_', 2)))
+    return sorted(packages)
+
+
+def parse_mirror_url(info: str):
+    ''' Archive URL of `aptly mirror show` '''
+    for line in info.split('\n'):
+        if line.startswith('Archive Root URL: '):
+            return line.split(': ', 1)[1]
+
+
+def mirror_show_state(info: str):
+    ''' Fingerprint of `aptly mirror show` (see Aptly.mirror_state) '''
+    lines = [line for line in info.split('\n')
+             if not line.startswith('Last update:')]
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+class TaskResult():
+    ''' Outcome of a single command executed via `aptly task run`:
+        status is one of ok, failed or skipped (aptly stops at the
+        first failing command).
+    '''
+    def __init__(self, command, output='', status='skipped'):
+        self.command = command
+        self.output = output
+        self.status = status
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    def check(self):
+        if not self.ok:
+            raise subprocess.CalledProcessError(
+                1, ['aptly'] + self.command, self.output)
+        return self.output
+
+
+def task_run_args(commands):
+    ''' Arguments for `aptly task run` executing all given commands '''
+    args = ['task', 'run']
+    for command in commands:
+        args.extend(command[:-1])
+        args.append(command[-1] + ',')
+    args[-1] = args[-1][:-1]
+    return args
+
+
+@contextlib.contextmanager
+def task_run(commands):
+    ''' Arguments for `aptly task run` executing all given commands.
+
+        The commands are passed in a file (one per line) as thousands of
+        them exceed the maximal size of the argument list. aptly splits
+        the lines at whitespace: commands with such arguments are passed
+        as arguments.
+    '''
+    if any(re.search(r'\s', arg) for command in commands for arg in command):
+        yield task_run_args(commands)
+        return
+    with tempfile.NamedTemporaryFile('w', prefix='reptly-',
+                                     suffix='.tasks') as f:
+        f.write(''.join(' '.join(command) + '\n' for command in commands))
+        f.flush()
+        yield ['task', 'run', '-filename=' + f.name]
+
+
+def parse_task_output(commands, output: str, returncode: int):
+    ''' Split the combined output of `aptly task run` into one
+        TaskResult per command
+    '''
+    results = [TaskResult(command) for command in commands]
+    current = None
+    lines = None
+    for line in output.split('\n'):
+        match = re.match(r'(\d+)\) \[(Running|Skipping)\]: ', line)
+        if match:
+            current = results[int(match.group(1)) - 1]
+            if match.group(2) == 'Running':
+                current.status = 'ok'
+            continue
+        if line.startswith('Begin command output: '):
+            lines = []
+        elif line.startswith('End command output: '):
+            if lines and lines[-1] == '':
+                lines.pop()
+            current.output = '\n'.join(lines) + '\n' if lines else ''
+            lines = None
+        elif lines is not None:
+            lines.append(line)
+    if returncode != 0:
+        running = [result for result in results if result.ok]
+        if running:
+            running[-1].status = 'failed'
+    return results
+
 
 class Aptly():
-    def __init__(self):
-        self.mirrors = self.get_raw_list('mirror')
-        self.repos = self.get_raw_list('repo')
-        self.snapshots = self.get_raw_list('snapshot')
+    # aptly locks its database: only one command can run at a time
+    concurrent = False
+
+    def __init__(self, url: str = 'http://localhost:8080', *,
+                 session=None, cache=None):
+        # the API is only used for information not available via the CLI
+        self.url = url.rstrip('/')
+        self.session = session or requests.Session()
+        self._lists = {}
         self._publications = None
         self.keyring = None
+        self.lock = threading.Lock()
+        self.cache = cache
+        self._index = None
+        self._planned = {}
+        self._packages = {}
+        self._meta = {}
+        # snapshots whose metadata is fetched with the next lookup
+        self._meta_wanted = set()
+        # ('created'|'dropped', snapshot) of this run (for the history)
+        self.changes = []
+
+    @property
+    def mirrors(self):
+        return self._list('mirror')
+
+    @property
+    def repos(self):
+        return self._list('repo')
+
+    @property
+    def snapshots(self):
+        return self._list('snapshot')
+
+    def _list(self, type):
+        if type not in self._lists:
+            self._lists[type] = self.get_raw_list(type)
+            if type == 'snapshot' and self.cache:
+                self.cache.prune(self._lists[type])
+        return self._lists[type]
+
+    def prefetch(self, *types):
+        ''' Load the given lists (mirror, repo, snapshot) if not done yet.
+            They are fetched concurrently if the backend supports it.
+        '''
+        missing = [type for type in types if type not in self._lists]
+        if len(missing) < 2:
+            for type in missing:
+                self._list(type)
+            return
+        if not self.concurrent:
+            commands = [[type, 'list', '-raw'] for type in missing]
+            for type, result in zip(missing, self.run_tasks(commands)):
+                self._lists[type] = result.check().split('\n')
+            if 'snapshot' in missing and self.cache:
+                self.cache.prune(self._lists['snapshot'])
+            return
+        with ThreadPoolExecutor(len(missing)) as pool:
+            for type, content in zip(missing,
+                                     pool.map(self.get_raw_list, missing)):
+                self._lists[type] = content
+        if 'snapshot' in missing and self.cache:
+            self.cache.prune(self._lists['snapshot'])
 
     def run(self, *args, **kwargs):
-        return subprocess.run(['aptly'] +
-                              [arg for arg in args if arg], **kwargs)
+        # aptly locks its database: serialize calls of parallel updates
+        with self.lock:
+            return self.execute(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        with trace.span('command', trace.command_name(args), args) as record:
+            try:
+                result = subprocess.run(['aptly'] +
+                                        [arg for arg in args if arg], **kwargs)
+            except subprocess.CalledProcessError as e:
+                record.status = e.returncode
+                record.size = len(e.stdout or b'') + len(e.stderr or b'')
+                raise
+            record.status = result.returncode
+            record.size = len(result.stdout or b'') + len(result.stderr or b'')
+        return result
+
+    def run_tasks(self, commands):
+        ''' Execute the given non-interactive commands within one aptly
+            process (via `aptly task run`); returns a TaskResult per
+            command
+        '''
+        commands = [[arg for arg in command if arg] for command in commands]
+        if not commands:
+            return []
+        with self.lock, task_run(commands) as args:
+            result = self.execute(*args, stdout=subprocess.PIPE)
+        results = parse_task_output(commands, result.stdout.decode('utf-8'),
+                                    result.returncode)
+        if result.returncode != 0 and \
+                all(r.status == 'skipped' for r in results):
+            # aptly failed before running any command (e.g. database lock)
+            raise subprocess.CalledProcessError(
+                result.returncode, result.args, result.stdout)
+        return results
+
+    def request(self, method: str, path: str, **kwargs):
+        with trace.span('http', f'{method} /api/{path}') as record:
+            r = self.session.request(method, self.url + '/api/' + path,
+                                     **kwargs)
+            record.status = r.status_code
+            record.size = len(r.content)
+        r.raise_for_status()
+        return r.json() if r.content else None
 
     def get_raw_list(self, type):
         return self.run(type, 'list', '-raw',
@@ -24,42 +351,196 @@ class Aptly():
 
     def publication(self, name, distribution):
         if self._publications is None:
-            r = requests.get('http://localhost:8080/api/publish')
             self._publications = {}
-            for publication in r.json():
-                if publication['Storage'] == '':
-                    target = publication['Prefix']
-                else:
-                    target = publication['Storage'] + ':' + publication['Prefix']
-                self._publications[(target, publication['Distribution'])] = publication
+            for publication in self.fetch_publications():
+                self._store_publication(publication)
         return self._publications.get((name, distribution), None)
 
+    def _store_publication(self, publication: dict):
+        if publication['Storage'] == '':
+            target = publication['Prefix']
+        else:
+            target = publication['Storage'] + ':' + publication['Prefix']
+        self._publications[(target, publication['Distribution'])] = publication
+
+    def refresh_publication(self, target: str, distribution: str):
+        ''' Reload a single publication after it has been changed '''
+        if self._publications is None:
+            return  # nothing loaded yet: the next access is up to date
+        try:
+            publication = self.fetch_publication(target, distribution)
+        except requests.RequestException:
+            # e.g. aptly before 1.6 cannot show a single publication: the
+            # change is done, reload all publications on the next access
+            self._publications = None
+            return
+        self._store_publication(publication)
+
+    def fetch_publications(self):
+        return self.request('GET', 'publish')
+
+    def fetch_publication(self, target: str, distribution: str):
+        return self.request(
+            'GET', f'publish/{api_prefix(target)}/{distribution}')
+
     def snapshot_info(self, name: str):
         content = self.run('snapshot', 'show', '-with-packages', name,
                            check=True, stdout=subprocess.PIPE)
         return content.stdout.decode('utf-8')
 
+    def snapshot_packages(self, name: str):
+        ''' Sorted list of (name, version, architecture) of all packages
+            in the given snapshot
+        '''
+        if name in self._packages:
+            return self._packages[name]
+        if name in self._planned:
+            sources, latest = self._planned[name]
+            packages = merge_packages([self.snapshot_packages(source)
+                                       for source in sources], latest=latest)
+        else:
+            packages = self.cache.get(name) if self.cache else None
+            if packages is None:
+                packages = self.fetch_snapshot_packages(name)
+                if self.cache:
+                    packages = self.cache.put(name, packages)
+        self._packages[name] = packages
+        return packages
+
+    def snapshot_fingerprint(self, name: str):
+        ''' Hash over the package list of the snapshot '''
+        if self.cache and name not in self._planned:
+            known = self.cache.get_fingerprint(name)
+            if known:
+                return known
+        return fingerprint(self.snapshot_packages(name))
+
+    def snapshots_identical(self, a: str, b: str):
+        return self.snapshot_fingerprint(a) == self.snapshot_fingerprint(b)
+
+    def fetch_snapshot_packages(self, name: str):
+        return parse_snapshot_packages(self.snapshot_info(name))
+
+    def want_snapshot_meta(self, names):
+        ''' Announce snapshots whose metadata will be needed: it is
+            fetched together with the next snapshot_meta lookup
+        '''
+        self._meta_wanted.update(names)
+
+    def snapshot_meta(self, name: str):
+        ''' SnapshotMeta of the given snapshot (and of all existing
+            wanted snapshots at once)
+        '''
+        if name not in self._meta:
+            existing = set(self.snapshots)  # the API list has the metadata
+            wanted, self._meta_wanted = self._meta_wanted, set()
+            wanted = {other for other in wanted
+                      if other in existing and other not in self._meta}
+            wanted.discard(name)
+            if name not in self._meta:
+                for meta in self.fetch_snapshot_meta([name] + sorted(wanted)):
+                    self._meta[meta.name] = meta
+        return self._meta[name]
+
+    def fetch_snapshot_meta(self, names):
+        ''' SnapshotMeta for the given snapshots; all are shown within one
+            aptly process
+        '''
+        return [parse_snapshot_show(result.check()) for result in
+                self.run_tasks([['snapshot', 'show', name]
+                                for name in names])]
+
+    def _snapshot_created(self, name: str, sources=()):
+        self.changes.append(('created', name))
+        self._meta[name] = SnapshotMeta(name, '', datetime.datetime.now(),
+                                        tuple(sources))
+        if 'snapshot' in self._lists:
+            self._lists['snapshot'].append(name)
+        if self._index is not None:
+            self._index.add(name)
+
+    def _snapshot_dropped(self, name: str):
+        self.changes.append(('dropped', name))
+        self._packages.pop(name, None)
+        self._meta.pop(name, None)
+        if self.cache:
+            self.cache.discard(name)
+        if 'snapshot' in self._lists and name in self._lists['snapshot']:
+            self._lists['snapshot'].remove(name)
+        if self._index is not None:
+            self._index.remove(name)
+
+    def snapshot_revisions(self, base: str):
+        ''' Sorted revisions N of all existing `<base>+rN` snapshots '''
+        if self._index is None:
+            self._index = SnapshotIndex(self.snapshots)
+        return self._index.get(base)
+
     def snapshot_drop(self, name: str, check: bool = True):
-        self.run('snapshot', 'drop', name,
-                 check=check, stdout=subprocess.DEVNULL)
+        result = self.run('snapshot', 'drop', name,
+                          check=check, stdout=subprocess.DEVNULL)
+        if result.returncode == 0:
+            self._snapshot_dropped(name)
+        return result.returncode == 0
+
+    def snapshot_drop_batch(self, names):
+        ''' Drop several snapshots; returns those that could not be dropped '''
+        failed = []
+        while names:
+            skipped = []
+            results = self.run_tasks([['snapshot', 'drop', name]
+                                      for name in names])
+            for name, result in zip(names, results):
+                if result.ok:
+                    self._snapshot_dropped(name)
+                elif result.status == 'failed':
+                    failed.append(name)
+                else:
+                    skipped.append(name)
+            if len(skipped) == len(names):  # no progress: do not retry
+                failed.extend(skipped)
+                break
+            names = skipped
+        return failed
+
+    def db_cleanup(self):
+        self.run('db', 'cleanup', check=True, stdout=subprocess.DEVNULL)
+
+    def snapshot_created(self, name: str):
+        return self.snapshot_meta(name).created
 
     def snapshot_mirror(self, snapshot: str, mirror: str):
-        self.run('snapshot', 'create',
-                 snapshot, 'from', 'mirror', mirror,
-                 check=True, stdout=subprocess.DEVNULL)
+        self._snapshot_create(snapshot, 'mirror', mirror)
 
     def snapshot_repo(self, snapshot: str, repo: str):
-        self.run('snapshot', 'create',
-                 snapshot, 'from', 'repo', repo,
-                 check=True, stdout=subprocess.DEVNULL)
+        self._snapshot_create(snapshot, 'repo', repo)
+
+    def _snapshot_create(self, snapshot: str, type: str, source: str):
+        # the package list is needed to compare the new snapshot anyway:
+        # fetch it within the same aptly process
+        results = self.run_tasks([
+            ['snapshot', 'create', snapshot, 'from', type, source],
+            ['snapshot', 'show', '-with-packages', snapshot],
+        ])
+        self._snapshot_create_done(snapshot, type, source, *results)
+
+    def _snapshot_create_done(self, snapshot, type, source, create, show):
+        create.check()
+        self._snapshot_created(snapshot, [(type, source)])
+        if show.ok:
+            packages = parse_snapshot_packages(show.output)
+            if self.cache:
+                packages = self.cache.put(snapshot, packages)
+            self._packages[snapshot] = packages
 
     def snapshot_diff(self, a: str, b: str):
-        diff = self.run('snapshot', 'diff', a, b,
-                        check=True, stdout=subprocess.PIPE).stdout
-        if b'Snapshots are identical.' in diff:
+        if self.snapshots_identical(a, b):
             return False
-        else:
-            return diff.decode('utf-8')
+        rows = diff_packages(self.snapshot_packages(a),
+                             self.snapshot_packages(b))
+        if not rows:
+            return False
+        return format_diff(rows)
 
     def snapshot_merge(self, name, sources, *, latest=False):
         args = ['snapshot', 'merge']
@@ -68,40 +549,81 @@ class Aptly():
         args.append(name)
         args.extend(sources)
         self.run(*args, check=True, stdout=subprocess.DEVNULL)
+        self._snapshot_merged(name, sources, latest)
+
+    def plan_merge(self, name, sources, latest):
+        ''' Register a merge that is only created if needed: its
+            packages are predicted from the package lists of the sources.
+            Returns whether planning is supported.
+        '''
+        self._planned[name] = (list(sources), latest is True)
+        self._packages.pop(name, None)
+        return True
+
+    def drop_plan(self, name):
+        self._planned.pop(name, None)
+        self._packages.pop(name, None)
+
+    def _snapshot_merged(self, name, sources, latest):
+        self.drop_plan(name)
+        self._snapshot_created(name, [('snapshot', source)
+                                      for source in sources])
+        if self.cache:
+            self.cache.put_merge(name, sources, latest is True)
+
+    def merged_snapshot(self, base, sources, latest):
+        ''' Name of an existing `<base>+rN` snapshot merged from exactly
+            the given sources (in this order) - or None
+        '''
+        if not self.cache:
+            return None
+        return self.cache.get_merge(base, sources, latest is True)
 
     def snapshot_sources(self, name):
-        snapshot_info = self.run('snapshot', 'show', name,
-                                 check=True, stdout=subprocess.PIPE)
-        lines = snapshot_info.stdout.decode('utf-8').split('\n')
-        if 'Sources:' not in lines:
-            return {}
-        candidate = lines.index('Sources:') + 1
-        types = {
-            'snapshot': ' [snapshot]',
-            'mirror': ' [repo]',
-            'repo': ' [local]',
-        }
-        for line in lines[candidate:]:
-            if not line.startswith('  '):
-                break
-            for label, suffix in types.items():
-                if not line.endswith(suffix):
-                    continue
-                yield label, line[2:].rsplit(' ', 1)[0]
-                break
-            else:
-                print(f'Ignore unknown snapshot source: {line} in ({name})')
+        if name in self._planned:
+            for source in self._planned[name][0]:
+                yield 'snapshot', source
+            return
+        yield from self.snapshot_meta(name).sources
 
     def mirror_update(self, name: str, *, quiet: bool = False):
+        ''' Update the mirror; returns the downloaded bytes if quiet '''
         if quiet:
-            extra_args = {'stdout': subprocess.DEVNULL,
+            extra_args = {'stdout': subprocess.PIPE,
                           'stderr': subprocess.PIPE}
         else:
             extra_args = {}
-        self.run('mirror', 'update',
-                 '-keyring=aptlykeys.gpg' if self.keyring else None,
-                 name,
-                 check=True, **extra_args)
+        # not serialized: downloads of several mirrors may overlap
+        result = self.execute('mirror', 'update',
+                              '-keyring=aptlykeys.gpg' if self.keyring
+                              else None,
+                              name,
+                              check=True, **extra_args)
+        if quiet:
+            return parse_download_size(result.stdout.decode('utf-8',
+                                                            'replace'))
+
+    def mirror_url(self, name: str):
+        info = self.run('mirror', 'show', name,
+                        check=True, stdout=subprocess.PIPE)
+        return parse_mirror_url(info.stdout.decode('utf-8'))
+
+    def mirror_state(self, name: str):
+        ''' Fingerprint of the downloaded mirror content: package count,
+            release file information and configuration. It changes when
+            an update fetched anything new.
+        '''
+        info = self.run('mirror', 'show', name,
+                        check=True, stdout=subprocess.PIPE)
+        return mirror_show_state(info.stdout.decode('utf-8'))
+
+    def snapshot_state(self, name: str):
+        ''' Recorded state of the source the snapshot has been taken from '''
+        return self.cache.get_state(name) if self.cache else None
+
+    def remember_snapshot_state(self, name: str, state: str):
+        if self.cache and state is not None:
+            self.cache.put_state(name, state)
 
     def publish(self, distro: str, target: str, content: dict, *,
                 architectures: List[str] = None,
@@ -117,14 +639,160 @@ class Aptly():
         args.append(target)
 
         self.run(*args, check=True)
+        self.refresh_publication(target, distro)
 
     def switch(self, distro, target, snapshot):
         self.run('publish', 'switch',
                  distro, target, snapshot,
                  check=True)
+        self.refresh_publication(target, distro)
 
     def switch_components(self, distro, target, changes):
         self.run('publish', 'switch',
                  '-component=' + ','.join(changes.keys()),
                  distro, target, *changes.values(),
                  check=True)
+        self.refresh_publication(target, distro)
+
+
+def api_prefix(target: str):
+    ''' Convert an aptly publish target (``[storage:]prefix``) into
+        the ``:prefix`` URL segment of the aptly API.
+    '''
+    storage, _, prefix = target.rpartition(':')
+    prefix = prefix.replace('_', '__').replace('/', '_')
+    if storage:
+        return storage + ':' + prefix
+    return prefix
+
+
+def parse_package_key(key: str):
+    ''' Split an aptly package key (``Pamd64 name version hash``)
+        into a (name, version, architecture) tuple.
+    '''
+    arch, name, version = key.split(' ')[:3]
+    return name, version, arch[1:]
+
+
+def api_mirror_state(mirror: dict):
+    ''' Fingerprint of a mirror of the API (see Aptly.mirror_state) '''
+    mirror = dict(mirror)
+    for volatile in ('LastDownloadDate', 'Status', 'WorkerPID'):
+        mirror.pop(volatile, None)
+    return hashlib.sha1(json.dumps(mirror, sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+def api_snapshot_meta(snapshot: dict):
+    return SnapshotMeta(snapshot['Name'], snapshot['Description'],
+                        parse_time(snapshot['CreatedAt']),
+                        tuple(parse_snapshot_description(
+                            snapshot['Description'])))
+
+
+class AptlyApi(Aptly):
+    ''' Aptly backend talking to the aptly REST API (`aptly api serve`)
+
+        All operations are HTTP requests through one pooled session.
+        Only `mirror update` still runs the aptly binary as it streams
+        its progress to the user.
+    '''
+    concurrent = True
+
+    def get_raw_list(self, type):
+        entries = self.request('GET', type + 's')
+        if type == 'snapshot':
+            # the snapshot list already contains all metadata
+            self._meta.update((entry['Name'], api_snapshot_meta(entry))
+                              for entry in entries)
+        return [entry['Name'] for entry in entries]
+
+    def mirror_url(self, name: str):
+        return self.request('GET', f'mirrors/{name}')['ArchiveRoot']
+
+    def mirror_state(self, name: str):
+        return api_mirror_state(self.request('GET', f'mirrors/{name}'))
+
+    def fetch_snapshot_packages(self, name: str):
+        return sorted(parse_package_key(key) for key in
+                      self.request('GET', f'snapshots/{name}/packages'))
+
+    def snapshot_info(self, name: str):
+        snapshot = self.request('GET', f'snapshots/{name}')
+        packages = self.snapshot_packages(name)
+        lines = [
+            f'Name: {snapshot["Name"]}',
+            f'Created At: {snapshot["CreatedAt"]}',
+            f'Description: {snapshot["Description"]}',
+            f'Number of packages: {len(packages)}',
+            'Packages:',
+        ]
+        lines.extend(f'  {n}_{v}_{a}' for n, v, a in packages)
+        return '\n'.join(lines) + '\n'
+
+    def snapshot_drop(self, name: str, check: bool = True):
+        try:
+            self.request('DELETE', f'snapshots/{name}')
+        except requests.HTTPError:
+            if check:
+                raise
+            return False
+        self._snapshot_dropped(name)
+        return True
+
+    def snapshot_drop_batch(self, names):
+        return [name for name in names
+                if not self.snapshot_drop(name, check=False)]
+
+    def db_cleanup(self):
+        self.request('POST', 'db/cleanup')
+
+    def snapshot_mirror(self, snapshot: str, mirror: str):
+        self.request('POST', f'mirrors/{mirror}/snapshots',
+                     json={'Name': snapshot})
+        self._snapshot_created(snapshot, [('mirror', mirror)])
+
+    def snapshot_repo(self, snapshot: str, repo: str):
+        self.request('POST', f'repos/{repo}/snapshots',
+                     json={'Name': snapshot})
+        self._snapshot_created(snapshot, [('repo', repo)])
+
+    def snapshot_merge(self, name, sources, *, latest=False):
+        params = {'latest': '1'} if latest is True else {}
+        self.request('POST', 'snapshots/merge', params=params,
+                     json={'Destination': name, 'Sources': list(sources)})
+        self._snapshot_merged(name, sources, latest)
+
+    def fetch_snapshot_meta(self, names):
+        return [api_snapshot_meta(self.request('GET', f'snapshots/{name}'))
+                for name in names]
+
+    def publish(self, distro: str, target: str, content: dict, *,
+                architectures: List[str] = None,
+                acquire_by_hash: bool = True):
+        publication = self.request(
+            'POST', 'publish/' + api_prefix(target), json={
+                'SourceKind': 'snapshot',
+                'Sources': [{'Component': component, 'Name': snapshot}
+                            for component, snapshot in content.items()],
+                'Distribution': distro,
+                'Architectures': architectures or [],
+                'AcquireByHash': acquire_by_hash,
+            })
+        if self._publications is not None:
+            self._store_publication(publication)
+
+    def switch(self, distro, target, snapshot):
+        publication = self.publication(target, distro)
+        component = publication['Sources'][0]['Component']
+        self.switch_components(distro, target, {component: snapshot})
+
+    def switch_components(self, distro, target, changes):
+        publication = self.request(
+            'PUT', f'publish/{api_prefix(target)}/{distro}', json={
+                'Snapshots': [{'Component': component, 'Name': snapshot}
+                              for component, snapshot in changes.items()],
+            })
+        # aptly answers with the updated publication
+        if self._publications is not None:
+            self._store_publication(publication)
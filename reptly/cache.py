@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from urllib.parse import quote, unquote
+import zlib
+
+
+def default_state_dir():
+    base = os.environ.get('XDG_STATE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'reptly')
+
+
+def fingerprint(packages):
+    ''' Hash over a sorted package list: equal for identical snapshots '''
+    content = '\n'.join('\0'.join(package) for package in packages)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def write_atomic(path: str, content: bytes):
+    ''' Replace path by content; concurrent writers use own temp files '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.',
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class SnapshotTable():
+    ''' JSON file storing one value per snapshot name
+
+        Changes are kept in memory until `write` (once per run).
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    @property
+    def entries(self):
+        with self.lock:
+            if self._entries is None:
+                try:
+                    with open(self.path, 'r') as f:
+                        self._entries = json.load(f)
+                except FileNotFoundError:
+                    self._entries = {}
+            return self._entries
+
+    def write(self):
+        entries = self.entries
+        with self.lock:
+            if not self.dirty:
+                return
+            content = json.dumps(entries, indent=0, sort_keys=True)
+            self.dirty = False
+        write_atomic(self.path, content.encode('utf-8'))
+
+    def get(self, name: str):
+        return self.entries.get(name)
+
+    def items(self):
+        entries = self.entries
+        with self.lock:
+            return list(entries.items())
+
+    def put(self, name: str, value):
+        entries = self.entries
+        with self.lock:
+            entries[name] = value
+            self.dirty = True
+
+    def discard(self, name: str):
+        entries = self.entries
+        with self.lock:
+            if entries.pop(name, None) is not None:
+                self.dirty = True
+
+    def prune(self, existing):
+        entries = self.entries
+        with self.lock:
+            unknown = set(entries) - existing
+            for name in unknown:
+                del entries[name]
+            if unknown:
+                self.dirty = True
+
+
+class SnapshotCache():
+    ''' Persistent cache of the package lists of snapshots
+
+        A snapshot never changes after its creation. Its package list
+        is therefore stored once (as zlib compressed, NUL separated
+        name, version and architecture fields) together with its
+        fingerprint and kept until the snapshot is dropped.
+
+        Additionally the state of the source a snapshot has been taken
+        from can be recorded (e.g. to detect unchanged mirrors) as well
+        as the sources merged snapshots have been created from.
+    '''
+    def __init__(self, state_dir: str):
+        self.directory = os.path.join(state_dir, 'snapshots')
+        os.makedirs(self.directory, exist_ok=True)
+        self.loaded = {}
+        self.fingerprints = SnapshotTable(
+            os.path.join(state_dir, 'fingerprints.json'))
+        self.states = SnapshotTable(
+            os.path.join(state_dir, 'snapshot-states.json'))
+        self.merges = SnapshotTable(os.path.join(state_dir, 'merges.json'))
+        self.tables = [self.fingerprints, self.states, self.merges]
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, quote(name, safe=''))
+
+    def get(self, name: str):
+        if name in self.loaded:
+            return self.loaded[name]
+        try:
+            with open(self._path(name), 'rb') as f:
+                content = zlib.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+        packages = []
+        if content:
+            for line in content.split('\n'):
+                packages.append(tuple(line.split('\0')))
+        self.loaded[name] = packages
+        return packages
+
+    def put(self, name: str, packages):
+        packages = sorted(packages)
+        content = '\n'.join('\0'.join(package) for package in packages)
+        write_atomic(self._path(name), zlib.compress(content.encode('utf-8')))
+        self.loaded[name] = packages
+        self.fingerprints.put(name, fingerprint(packages))
+        return packages
+
+    def flush(self):
+        ''' Write the changed fingerprints, states and merges '''
+        for table in self.tables:
+            table.write()
+
+    def get_fingerprint(self, name: str):
+        return self.fingerprints.get(name)
+
+    def get_state(self, name: str):
+        return self.states.get(name)
+
+    def put_state(self, name: str, state: str):
+        self.states.put(name, state)
+
+    def get_merge(self, base: str, sources, latest: bool):
+        ''' Name of a `<base>+rN` snapshot merged from the sources '''
+        for name, merge in self.merges.items():
+            if name.rpartition('+r')[0] == base and \
+                    merge['sources'] == list(sources) and \
+                    merge['latest'] == latest:
+                return name
+        return None
+
+    def put_merge(self, name: str, sources, latest: bool):
+        self.merges.put(name, {'sources': list(sources), 'latest': latest})
+
+    def discard(self, name: str):
+        self.loaded.pop(name, None)
+        for table in self.tables:
+            table.discard(name)
+        try:
+            os.unlink(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, existing):
+        ''' Forget all snapshots that do not exist anymore
+            (e.g. dropped without reptly)
+        '''
+        existing = set(existing)
+        for entry in os.listdir(self.directory):
+            if entry.startswith('.') and entry.endswith('.tmp'):
+                continue  # being written
+            name = unquote(entry)
+            if name not in existing:
+                self.loaded.pop(name, None)
+                os.unlink(os.path.join(self.directory, entry))
+        for table in self.tables:
+            table.prune(existing)
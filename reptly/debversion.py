@@ -0,0 +1,62 @@
+''' Debian package version ordering (as implemented by dpkg)
+
+    Versions are parsed once into a flat tuple of integers that sorts
+    like dpkg compares versions: version_key can be used as sort key,
+    e.g. sorted(versions, key=version_key) or max(versions, key=version_key).
+'''
+import functools
+import re
+import string
+
+_fragments = re.compile(r'(\D*)(\d*)')
+
+
+def _char_order(char: str):
+    if char == '~':  # sorts before everything, even the end of a part
+        return -1
+    if char in string.ascii_letters:
+        return ord(char)
+    return ord(char) + 256  # non-letters sort after letters
+
+
+_order = {chr(i): _char_order(chr(i)) for i in range(128)}
+
+
+@functools.lru_cache(maxsize=None)
+def _part_key(part: str):
+    ''' Key for an upstream version or revision: alternating non-digit
+        prefixes (compared char by char, 0 marks their end) and numbers.
+    '''
+    fragments = _fragments.findall(part)
+    # trailing empty fragments (e.g. "0") do not change the order
+    while fragments and not fragments[-1][0] and \
+            not fragments[-1][1].strip('0'):
+        fragments.pop()
+    key = []
+    for text, digits in fragments:
+        key.extend(_order.get(char, 256 + ord(char)) for char in text)
+        key.append(0)
+        key.append(int(digits or 0))
+    key.extend((0, 0))  # end of part
+    return tuple(key)
+
+
+@functools.lru_cache(maxsize=None)
+def version_key(version: str):
+    ''' Comparable key of a Debian version: epoch, upstream and revision
+        part keys as one tuple
+    '''
+    epoch = 0
+    if ':' in version:
+        epoch, version = version.split(':', 1)
+    revision = ''
+    if '-' in version:
+        version, revision = version.rsplit('-', 1)
+    return (int(epoch or 0),) + _part_key(version) + _part_key(revision)
+
+
+def compare_versions(a: str, b: str):
+    ''' Compare like dpkg --compare-versions: -1, 0 or 1 '''
+    a = version_key(a)
+    b = version_key(b)
+    return (a > b) - (a < b)
@@ -0,0 +1,68 @@
+import collections
+
+from reptly.debversion import version_key
+
+
+def diff_packages(old, new):
+    ''' Compare two package lists of (name, version, architecture) tuples.
+
+        Returns the rows `aptly snapshot diff` would print as
+        (marker, architecture, name, version in old, version in new)
+        tuples: - for removed, + for added and ! for updated packages.
+    '''
+    old = set(old)
+    new = set(new)
+    # aptly walks the package references `P<arch> <name> <version>`:
+    # rows are ordered by architecture first
+    changes = collections.defaultdict(lambda: ([], []))
+    for name, version, arch in old - new:
+        changes[(arch, name)][0].append(version)
+    for name, version, arch in new - old:
+        changes[(arch, name)][1].append(version)
+
+    rows = []
+    for (arch, name), (removed, added) in sorted(changes.items()):
+        if len(removed) == 1 and len(added) == 1:
+            rows.append(('!', arch, name, removed[0], added[0]))
+            continue
+        for version in sorted(removed):
+            rows.append(('-', arch, name, version, '-'))
+        for version in sorted(added):
+            rows.append(('+', arch, name, '-', version))
+    return rows
+
+
+def format_diff(rows):
+    ''' Render diff rows like `aptly snapshot diff` does. '''
+    lines = ['  %-6s | %-40s | %-40s | %-40s' % (
+        'Arch', 'Package', 'Version in A', 'Version in B')]
+    for row in rows:
+        lines.append('%s %-6s | %-40s | %-40s | %-40s' % row)
+    return '\n'.join(lines) + '\n'
+
+
+def merge_packages(package_lists, *, latest=False):
+    ''' Predict the packages of `aptly snapshot merge` of snapshots
+        with the given package lists.
+
+        Without latest, packages of later snapshots replace all packages
+        with the same name and architecture of earlier ones. With latest
+        all packages are combined and only the latest version of every
+        name and architecture is kept.
+    '''
+    merged = {}
+    for packages in package_lists:
+        own = collections.defaultdict(set)
+        for name, version, arch in packages:
+            own[(name, arch)].add(version)
+        for key, versions in own.items():
+            if latest and key in merged:
+                merged[key] |= versions
+            else:
+                merged[key] = versions
+    result = []
+    for (name, arch), versions in merged.items():
+        if latest:
+            versions = [max(versions, key=version_key)]
+        result.extend((name, version, arch) for version in versions)
+    return sorted(result)
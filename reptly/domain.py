@@ -1,6 +1,10 @@
 import collections
 from functools import partial
 import re
+from urllib.parse import urlparse
+
+from reptly import trace
+from reptly.aio import in_thread
 
 Diff = collections.namedtuple('Diff', ('diff', 'old', 'new'))
 
@@ -21,12 +25,40 @@ class SnapshotContentMixin():
             self.name = name
             self.rev = rev
             self.temporary = temporary
+            # (sources, latest) of a merge that is not created yet
+            self.planned = None
+
+        def create(self):
+            ''' Create a planned merge snapshot '''
+            if not self.planned:
+                return
+            sources, latest = self.planned
+            self.planned = None
+            self.temporary.snapshot_merge(self.name, sources, latest=latest)
+
+        async def create_async(self, aio):
+            if not self.planned:
+                return
+            sources, latest = self.planned
+            self.planned = None
+            await aio.snapshot_merge(self.name, sources, latest=latest)
 
         def delete(self):
             if not self.temporary:
                 return
+            if self.planned:  # never created
+                self.temporary.drop_plan(self.name)
+                return
             self.temporary.snapshot_drop(self.name)
 
+        async def delete_async(self, aio):
+            if not self.temporary:
+                return
+            if self.planned:  # never created
+                self.temporary.drop_plan(self.name)
+                return
+            await aio.snapshot_drop(self.name)
+
         def __eq__(self, other):
             if type(other) != type(self):
                 raise NotImplementedError()
@@ -38,22 +70,22 @@ class SnapshotContentMixin():
     def publication_candidate(self, _published):
         return self.current
 
+    async def publication_candidate_async(self, _published, aio):
+        return await self.current_async(aio)
+
+    async def current_async(self, aio):
+        return self.current
+
     def _extract_own_snapshots(self):
-        self.snapshots = []
-        for s in self.aptly.snapshots:
-            if not s.startswith(self.name + '+r'):
-                continue
-            self.snapshots.append(self.Snapshot(s, int(s.split('+r')[1])))
-        self.snapshots = sorted(self.snapshots,
-                                key=lambda s: s.rev)
+        self.snapshots = [
+            self.Snapshot(f'{self.name}+r{rev}', rev)
+            for rev in self.aptly.snapshot_revisions(self.name)
+        ]
 
     @property
     def current(self):
-        return max(
-            self.snapshots,
-            key=lambda s: s.rev,
-            default=None
-        )
+        # snapshots are sorted by revision
+        return self.snapshots[-1] if self.snapshots else None
 
     def _new_snapshot(self):
         current = self.current or self.Snapshot(None, 0)
@@ -83,11 +115,6 @@ class SnapshotContentMixin():
         self.snapshots.append(new)
         return Diff(diff, current, new)
 
-    def update_all(self, args):
-        u = self.update(args)
-        if u:
-            yield u
-
 
 class Mirror(SnapshotContentMixin):
     constructor = '!mirror'
@@ -96,6 +123,8 @@ class Mirror(SnapshotContentMixin):
     def __init__(self, name):
         self.name = name
         self.snapshots = []
+        self.downloaded = None  # bytes fetched by the last update
+        self.url = None
 
     def __repr__(self):
         return 'Mirror({self.name})'.format(self=self)
@@ -107,13 +136,51 @@ class Mirror(SnapshotContentMixin):
         self._extract_own_snapshots()
         return self
 
+    @property
+    def host(self):
+        if self.url is None:
+            self.url = self.aptly.mirror_url(self.name)
+        return urlparse(self.url).hostname
+
+    async def host_async(self, aio):
+        if self.url is None:
+            self.url = await aio.mirror_url(self.name)
+        return self.host
+
     def update(self, args):
         # 1. update mirror
-        self.ui.mirror_update(self,
-                              partial(self.aptly.mirror_update, self.name))
+        if args.jobs > 1:
+            # updated in parallel: progress output would interleave
+            self.downloaded = self.aptly.mirror_update(self.name, quiet=True)
+        else:
+            self.downloaded = self.ui.mirror_update(
+                self, partial(self.aptly.mirror_update, self.name))
+        # 2. snapshot it - unless nothing changed since the current snapshot
+        state = self.aptly.mirror_state(self.name)
         current, new = self._new_snapshot()
+        if self._unchanged(current, state):
+            return False
         self.aptly.snapshot_mirror(new.name, self.name)
-        return self._snapshot_new(current, new)
+        return self._snapshot_mirrored(current, new, state)
+
+    async def update_async(self, args, aio):
+        ''' update() with the aptly commands awaited via AsyncAptly '''
+        self.downloaded = await aio.mirror_update(self.name)
+        state = await aio.mirror_state(self.name)
+        current, new = self._new_snapshot()
+        if self._unchanged(current, state):
+            return False
+        await aio.snapshot_mirror(new.name, self.name)
+        return await aio.call(self._snapshot_mirrored, current, new, state)
+
+    def _unchanged(self, current, state):
+        return current.rev and state is not None and \
+            self.aptly.snapshot_state(current.name) == state
+
+    def _snapshot_mirrored(self, current, new, state):
+        update = self._snapshot_new(current, new)
+        self.aptly.remember_snapshot_state(self.current.name, state)
+        return update
 
     @classmethod
     def byname(cls, name):
@@ -125,6 +192,7 @@ class Mirror(SnapshotContentMixin):
 class Repo(SnapshotContentMixin):
     constructor = '!repo'
     repos = {}
+    host = None  # local repos have no upstream
 
     def __init__(self, name):
         self.name = name
@@ -143,6 +211,14 @@ class Repo(SnapshotContentMixin):
         self.aptly.snapshot_repo(new.name, self.name)
         return self._snapshot_new(current, new)
 
+    async def update_async(self, args, aio):
+        current, new = self._new_snapshot()
+        await aio.snapshot_repo(new.name, self.name)
+        return await aio.call(self._snapshot_new, current, new)
+
+    async def host_async(self, aio):
+        return None
+
     @classmethod
     def byname(cls, name):
         if name not in cls.repos:
@@ -190,10 +266,6 @@ class Merge(SnapshotContentMixin):
         self._extract_own_snapshots()
         return self
 
-    def update_all(self, args):
-        for source in self.sources:
-            yield from source.update_all(args)
-
     def __repr__(self):
         return 'Merge({self.name}, {self.sources!r}, latest={self.latest})'.format(self=self)
 
@@ -212,7 +284,24 @@ class Merge(SnapshotContentMixin):
                                   latest=self.latest)
         return new
 
+    async def current_async(self, aio):
+        if self.snapshots:
+            return self.snapshots[-1]
+        new = self.Snapshot(f'{self.name}+r{1}', 1, temporary=self.aptly)
+        await aio.snapshot_merge(new.name,
+                                 [s.current.name for s in self.sources],
+                                 latest=self.latest)
+        return new
+
     def publication_candidate(self, published_snapshot):
+        with trace.phase('merge'):
+            return self._merge_candidate(published_snapshot)
+
+    async def publication_candidate_async(self, published_snapshot, aio):
+        with trace.phase('merge'):
+            return await self._merge_candidate_async(published_snapshot, aio)
+
+    def _merge_candidate(self, published_snapshot):
         published_sources = snapshot_sources(self.aptly, published_snapshot)
         merge = []
         for source in self.sources:
@@ -242,9 +331,64 @@ class Merge(SnapshotContentMixin):
             answer = self.ui.remove_snapshot(snapshot, info)
             if answer:
                 merge.append(answer)
+        new = self._merged(merge)
+        if new.planned and not self.aptly.plan_merge(new.name, *new.planned):
+            new.create()
+        return new
+
+    async def _merge_candidate_async(self, published_snapshot, aio):
+        ''' _merge_candidate() with the aptly operations awaited via
+            AsyncAptly and the questions asked in a worker thread
+        '''
+        published_sources = await aio.call(snapshot_sources, self.aptly,
+                                           published_snapshot)
+        merge = []
+        for source in self.sources:
+            published = published_sources.pop(source.name, None)
+            newest = source.current
+            if not published:
+                info = await aio.call(self.aptly.snapshot_info, newest.name)
+                answer = await in_thread(self.ui.include_snapshot,
+                                         newest, info)
+                if answer:
+                    merge.append(answer)
+                    continue
+            if published.rev == newest.rev:
+                merge.append(newest)
+                continue
+            diff = await aio.call(self.aptly.snapshot_diff, published.name,
+                                  newest.name)
+            if not diff:
+                merge.append(newest)
+                continue
+            answer = await in_thread(self.ui.update_snapshot, published,
+                                     newest, diff=diff, source=source)
+            if answer:
+                merge.append(answer)
+            else:
+                return None
+        for snapshot in published_sources.values():
+            info = await aio.call(self.aptly.snapshot_info, snapshot.name)
+            answer = await in_thread(self.ui.remove_snapshot, snapshot, info)
+            if answer:
+                merge.append(answer)
+        new = self._merged(merge)
+        if new.planned and not self.aptly.plan_merge(new.name, *new.planned):
+            await new.create_async(aio)
+        return new
+
+    def _merged(self, merge):
+        ''' Snapshot merged from the given snapshots: an existing one or
+            a new planned merge
+        '''
+        # reuse the result if these snapshots have been merged before
+        existing = self.aptly.merged_snapshot(
+            self.name, [s.name for s in merge], self.latest)
+        if existing:
+            return self.Snapshot(existing, int(existing.split('+r')[-1]))
         _, new = self._new_snapshot()
-        self.aptly.snapshot_merge(new.name, [s.name for s in merge],
-                                  latest=self.latest)
+        # merge only once it is published if its content can be predicted
+        new.planned = ([s.name for s in merge], self.latest)
         return new
 
 
@@ -254,6 +398,8 @@ class Publish():
         self.distribution = distribution
         self.architectures = []
         self.alias = config.pop('alias')
+        # Diff of every component switched by publish (for the history)
+        self.switched = {}
 
         if 'components' in config:
             assert 'component' not in config, \
@@ -288,7 +434,8 @@ class Publish():
             candidate.delete()
             return False
         # 1. print diff to user:
-        diff = self.aptly.snapshot_diff(publishedSnapshot, candidate.name)
+        with trace.phase('diff'):
+            diff = self.aptly.snapshot_diff(publishedSnapshot, candidate.name)
         if not diff:
             old = snapshot_sources(self.aptly, publishedSnapshot)
             new = snapshot_sources(self.aptly, candidate.name)
@@ -296,6 +443,7 @@ class Publish():
             assert new == new
             self.ui.skip_switch()
             if old != new:
+                candidate.create()
                 return Diff(diff, publishedSnapshot, candidate)
             candidate.delete()
             return None
@@ -303,11 +451,51 @@ class Publish():
                           target=self.target,
                           distribution=self.distribution,
                           component=component):
+            candidate.create()
             return Diff(diff, publishedSnapshot, candidate)
         else:
             candidate.delete()
             return False
 
+    async def _define_switch_async(self, component, publishedSnapshot, aio):
+        ''' _define_switch() with the aptly operations awaited via
+            AsyncAptly and the questions asked in a worker thread
+        '''
+        self.ui.prepare_switch(self, component)
+        source = self.components[component]
+        candidate = await source.publication_candidate_async(
+            publishedSnapshot, aio)
+        if not candidate:
+            self.ui.skip_switch()
+            return False
+        if publishedSnapshot == candidate.name:  # same snapshot
+            self.ui.skip_switch()
+            await candidate.delete_async(aio)
+            return False
+        with trace.phase('diff'):
+            diff = await aio.call(self.aptly.snapshot_diff,
+                                  publishedSnapshot, candidate.name)
+        if not diff:
+            old = await aio.call(snapshot_sources, self.aptly,
+                                 publishedSnapshot)
+            new = await aio.call(snapshot_sources, self.aptly,
+                                 candidate.name)
+            self.ui.skip_switch()
+            if old != new:
+                await candidate.create_async(aio)
+                return Diff(diff, publishedSnapshot, candidate)
+            await candidate.delete_async(aio)
+            return None
+        if await in_thread(self.ui.switch, diff,
+                           target=self.target,
+                           distribution=self.distribution,
+                           component=component):
+            await candidate.create_async(aio)
+            return Diff(diff, publishedSnapshot, candidate)
+        else:
+            await candidate.delete_async(aio)
+            return False
+
     def _publish_initially(self):
         self.aptly.publish(
             self.distribution, self.target,
@@ -321,7 +509,10 @@ class Publish():
         if not wanted:
             return
 
-        self.aptly.switch(self.distribution, self.target, wanted.new.name)
+        with trace.phase('switch'):
+            self.aptly.switch(self.distribution, self.target,
+                              wanted.new.name)
+        self.switched[component] = wanted
         if re.match('.*\+r[0-9]+$', wanted.old):
             self.aptly.snapshot_drop(wanted.old, check=False)
 
@@ -331,26 +522,73 @@ class Publish():
             wanted = self._define_switch(component,
                                          publishedSnapshots[component])
             if wanted:
-                switching_components[component] = wanted.new.name
+                switching_components[component] = wanted
 
         if switching_components:
-            self.aptly.switch_components(self.distribution, self.target,
-                                         switching_components)
+            with trace.phase('switch'):
+                self.aptly.switch_components(
+                    self.distribution, self.target,
+                    {component: wanted.new.name
+                     for component, wanted in switching_components.items()})
+            self.switched.update(switching_components)
 
     def publish(self, args):
         p = self.aptly.publication(self.target, self.distribution)
         if p is None:  # first publication:
             return self._publish_initially()
-        currentSnapshots = {s['Component']: s['Name'] for s in p['Sources']}
-        assert set(currentSnapshots) == set(self.components), \
-            'aptly for now does not support changing the list of components' \
-            ': republish the repository!'
+        currentSnapshots = self._published_snapshots(p)
 
         if len(self.components) < 2:
             self._publish_component(*currentSnapshots.popitem())
         else:
             self._publish_components(currentSnapshots)
 
-    def update_all(self, args):
+    async def publish_async(self, args, aio):
+        ''' publish() with the aptly operations awaited via AsyncAptly:
+            only the questions are asked in worker threads
+        '''
+        p = await aio.call(self.aptly.publication, self.target,
+                           self.distribution)
+        if p is None:  # first publication:
+            content = {}
+            for component, source in self.components.items():
+                content[component] = (await source.current_async(aio)).name
+            return await aio.publish(self.distribution, self.target, content,
+                                     architectures=self.architectures,
+                                     acquire_by_hash=True)
+        switching_components = {}
+        for component, published in self._published_snapshots(p).items():
+            wanted = await self._define_switch_async(component, published,
+                                                     aio)
+            if wanted:
+                switching_components[component] = wanted
+        if not switching_components:
+            return
+        with trace.phase('switch'):
+            await aio.switch_components(
+                self.distribution, self.target,
+                {component: wanted.new.name
+                 for component, wanted in switching_components.items()})
+        self.switched.update(switching_components)
+        if len(self.components) < 2:
+            wanted, = switching_components.values()
+            if re.match(r'.*\+r[0-9]+$', wanted.old):
+                await aio.snapshot_drop(wanted.old, check=False)
+
+    def _published_snapshots(self, p):
+        ''' Published snapshot per component '''
+        currentSnapshots = {s['Component']: s['Name'] for s in p['Sources']}
+        # look up the sources of published and newest snapshots at once
+        wanted = list(currentSnapshots.values())
         for source in self.components.values():
-            yield from source.update_all(args)
+            if type(source) is Merge:  # current would create a merge
+                newest = source.snapshots[-1] if source.snapshots else None
+            else:
+                newest = source.current
+            if newest:
+                wanted.append(newest.name)
+        self.aptly.want_snapshot_meta(wanted)
+        assert set(currentSnapshots) == set(self.components), \
+            'aptly for now does not support changing the list of components' \
+            ': republish the repository!'
+        return currentSnapshots
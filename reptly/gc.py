@@ -0,0 +1,100 @@
+import datetime
+import fnmatch
+
+from reptly.domain import Merge, Mirror, Repo
+
+DEFAULTS = {
+    'keep': 5,  # newest revisions to keep per source
+    'min-age': 7,  # keep snapshots younger than this (in days)
+}
+
+
+class GarbageCollector():
+    ''' Drop old `<name>+rN` snapshots of mirrors, repos and merges
+
+        A snapshot is kept if it is one of the `keep` newest revisions of
+        its source, younger than `min-age` days, published or a source of
+        another kept (merge) snapshot. The rules can be configured
+        globally and per source:
+
+        gc:
+          keep: 3
+          min-age: 14
+          sources:
+            big-mirror:
+              keep: 1
+    '''
+    batch = 50
+
+    def __init__(self, app, config):
+        self.app = app
+        self.aptly = app.aptly
+        self.config = config or {}
+
+    def retention(self, source):
+        rules = dict(DEFAULTS)
+        rules.update({key: value for key, value in self.config.items()
+                      if key != 'sources'})
+        rules.update(self.config.get('sources', {}).get(source.name, {}))
+        return rules
+
+    def sources(self):
+        ''' All snapshotted sources - merges first as they reference
+            snapshots of the others
+        '''
+        merges = []
+        for p in self.app.publications:
+            for source in p.components.values():
+                if type(source) is Merge:
+                    merges.append(source)
+        return merges + list(Mirror.mirrors.values()) + \
+            list(Repo.repos.values())
+
+    def published(self):
+        names = set()
+        for p in self.app.publications:
+            publication = self.aptly.publication(p.target, p.distribution)
+            if publication:
+                names.update(s['Name'] for s in publication['Sources'])
+        return names
+
+    def _old(self, snapshot, min_age):
+        if not min_age:
+            return True
+        age = datetime.datetime.now() - self.aptly.snapshot_created(snapshot.name)
+        return age > datetime.timedelta(days=min_age)
+
+    def candidates(self, filter):
+        ''' Names of the snapshots to drop (merges first) '''
+        keep = self.published()
+        drop = []
+        self.aptly.want_snapshot_meta(
+            snapshot.name for source in self.sources()
+            for snapshot in source.snapshots)
+        for source in self.sources():
+            rules = self.retention(source)
+            selected = any(fnmatch.fnmatch(source.name, f) for f in filter)
+            for index, snapshot in enumerate(reversed(source.snapshots)):
+                if selected and index >= rules['keep'] and \
+                        snapshot.name not in keep and \
+                        self._old(snapshot, rules['min-age']):
+                    drop.append(snapshot.name)
+                    continue
+                keep.add(snapshot.name)
+                if type(source) is Merge:
+                    keep.update(name for type, name in
+                                self.aptly.snapshot_sources(snapshot.name)
+                                if type == 'snapshot')
+        return drop
+
+    def collect(self, filter, *, dry_run=False):
+        drop = self.candidates(filter)
+        for name in drop:
+            print(f'{"Would drop" if dry_run else "Dropping"} {name}')
+        if dry_run or not drop:
+            return
+        for start in range(0, len(drop), self.batch):
+            for name in self.aptly.snapshot_drop_batch(
+                    drop[start:start + self.batch]):
+                print(f'Failed to drop {name}')
+        self.aptly.db_cleanup()
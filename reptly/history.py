@@ -0,0 +1,229 @@
+''' History of reptly runs in a local SQLite database
+
+Every run records the duration and result of each source update, the
+snapshots created or dropped and the publication switches with the size
+of their diff. `reptly history` reports duration percentiles and change
+frequencies per source and flags sources whose updates became slower
+than their own baseline.
+'''
+import datetime
+import fnmatch
+import os
+import sqlite3
+import time
+
+from reptly.metrics import changed_packages, diff_size
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    action TEXT NOT NULL,
+    success INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS updates (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    source TEXT NOT NULL,
+    duration REAL NOT NULL,
+    status TEXT NOT NULL,
+    changed_packages INTEGER,
+    downloaded_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS updates_source ON updates (source, run);
+CREATE TABLE IF NOT EXISTS snapshots (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    action TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS switches (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    publication TEXT NOT NULL,
+    component TEXT NOT NULL,
+    old TEXT,
+    new TEXT NOT NULL,
+    changed_packages INTEGER NOT NULL,
+    duration REAL
+);
+'''
+
+
+def default_path(state_dir: str):
+    return os.path.join(state_dir, 'history.sqlite')
+
+
+def percentile(values, p: float):
+    ''' p-th percentile of the sorted values (linear interpolation) '''
+    if not values:
+        return None
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * \
+        (position - lower)
+
+
+def phase_durations(tracer, name: str):
+    ''' Total duration of the phases `name` per alias '''
+    durations = {}
+    for record in tracer.records if tracer else ():
+        if record.kind == 'phase' and record.name == name and record.alias:
+            durations[record.alias] = \
+                durations.get(record.alias, 0) + record.duration
+    return durations
+
+
+class History():
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record(self, app, tracer, *, action: str, started: float,
+               duration: float, success: bool):
+        ''' Store a run; durations are taken from the trace records '''
+        results = {source.name: (source, update)
+                   for source, update in app.updates.items()}
+        switch_durations = phase_durations(tracer, 'switch')
+        with self.connection as db:
+            run = db.execute(
+                'INSERT INTO runs (started, duration, action, success) '
+                'VALUES (?, ?, ?, ?)',
+                (started, duration, action, int(success))).lastrowid
+            for name, seconds in phase_durations(tracer, 'update').items():
+                if name not in results:  # update raised
+                    db.execute(
+                        'INSERT INTO updates (run, source, duration, status) '
+                        'VALUES (?, ?, ?, ?)', (run, name, seconds, 'failed'))
+                    continue
+                source, update = results[name]
+                db.execute(
+                    'INSERT INTO updates VALUES (?, ?, ?, ?, ?, ?)',
+                    (run, name, seconds,
+                     'changed' if update else 'unchanged',
+                     changed_packages(update),
+                     getattr(source, 'downloaded', None)))
+            db.executemany(
+                'INSERT INTO snapshots (run, action, name) VALUES (?, ?, ?)',
+                [(run, change, name)
+                 for change, name in getattr(app.aptly, 'changes', ())])
+            for p in app.publications:
+                for component, diff in p.switched.items():
+                    db.execute(
+                        'INSERT INTO switches VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (run, p.alias, component, diff.old, diff.new.name,
+                         diff_size(diff.diff),
+                         switch_durations.get(p.alias)))
+        return run
+
+    def updates(self, *, since: float = None):
+        ''' (source, started, duration, status) of all recorded updates in
+            chronological order
+        '''
+        return self.connection.execute(
+            'SELECT source, started, updates.duration, status '
+            'FROM updates JOIN runs ON runs.id = updates.run '
+            'WHERE started >= ? ORDER BY run', (since or 0,)).fetchall()
+
+    def expected_durations(self, recent: int = 5):
+        ''' Median duration of the `recent` last successful updates per
+            source
+        '''
+        durations = {}
+        for source, _, duration, status in self.updates():
+            if status != 'failed':
+                durations.setdefault(source, []).append(duration)
+        return {source: percentile(sorted(values[-recent:]), 50)
+                for source, values in durations.items()}
+
+    def analyze(self, patterns=('*',), *, since: float = None,
+                recent: int = 5, threshold: float = 1.5):
+        ''' Statistics per source: number of updates and failures,
+            duration percentiles of successful updates, changed ratio,
+            changes per day and whether the median of the `recent` last
+            updates exceeds `threshold` times the median of the ones
+            before (the baseline)
+        '''
+        per_source = {}
+        for source, started, duration, status in self.updates(since=since):
+            if any(fnmatch.fnmatch(source, f) for f in patterns):
+                per_source.setdefault(source, []).append(
+                    (started, duration, status))
+        stats = []
+        for source, updates in sorted(per_source.items()):
+            succeeded = [u for u in updates if u[2] != 'failed']
+            durations = [duration for _, duration, _ in succeeded]
+            ordered = sorted(durations)
+            changes = sum(1 for u in succeeded if u[2] == 'changed')
+            days = max((updates[-1][0] - updates[0][0]) / 86400, 1)
+            baseline = sorted(durations[:-recent])
+            latest = sorted(durations[-recent:])
+            regressed = None  # not enough data
+            if len(baseline) >= recent:
+                regressed = percentile(latest, 50) > \
+                    threshold * percentile(baseline, 50)
+            stats.append({
+                'source': source,
+                'updates': len(updates),
+                'failed': len(updates) - len(succeeded),
+                'p50': percentile(ordered, 50),
+                'p90': percentile(ordered, 90),
+                'max': ordered[-1] if ordered else None,
+                'last': durations[-1] if durations else None,
+                'changed': changes / len(succeeded) if succeeded else 0,
+                'per_day': changes / days,
+                'baseline': percentile(baseline, 50),
+                'regressed': regressed,
+            })
+        return stats
+
+    def report(self, patterns=('*',), *, since: float = None,
+               recent: int = 5, threshold: float = 1.5):
+        stats = self.analyze(patterns, since=since, recent=recent,
+                             threshold=threshold)
+        if not stats:
+            return 'No updates recorded\n'
+
+        def seconds(value):
+            return '-' if value is None else f'{value:.1f}'
+
+        rows = [('source', 'updates', 'failed', 'p50', 'p90', 'max',
+                 'last', 'changed', 'per day', '')]
+        for s in stats:
+            flag = ''
+            if s['regressed']:
+                flag = f'REGRESSED (baseline p50 {seconds(s["baseline"])})'
+            rows.append((s['source'], str(s['updates']), str(s['failed']),
+                         seconds(s['p50']), seconds(s['p90']),
+                         seconds(s['max']), seconds(s['last']),
+                         f'{s["changed"]:.0%}', f'{s["per_day"]:.2f}', flag))
+        widths = [max(len(row[i]) for row in rows) for i in range(9)]
+        lines = []
+        for row in rows:
+            lines.append('  '.join(
+                [row[0].ljust(widths[0])] +
+                [cell.rjust(width) for cell, width in zip(row[1:9],
+                                                          widths[1:])] +
+                [row[9]]).rstrip())
+        first = self.connection.execute(
+            'SELECT MIN(started), COUNT(*) FROM runs WHERE started >= ?',
+            (since or 0,)).fetchone()
+        start = datetime.datetime.fromtimestamp(first[0] or time.time())
+        lines.append('')
+        lines.append(f'{first[1]} runs since {start:%Y-%m-%d %H:%M}; '
+                     'durations in seconds of successful updates')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,289 @@
+''' Read-only access to the LevelDB database of aptly (`<rootDir>/db`)
+
+Listing mirrors, repos and snapshots, resolving snapshot sources and
+reading package lists does not need the aptly binary: the records can be
+decoded directly. All changes are still made through aptly.
+
+Opening a LevelDB database writes to it (log replay, new manifest, lock
+file): reptly reads from a private checkpoint of the database files
+instead, so aptly's files are never modified.
+'''
+import datetime
+import fcntl
+import os
+import shutil
+import tempfile
+
+try:
+    import msgpack
+    import plyvel
+except ImportError:  # optional dependencies
+    msgpack = None
+    plyvel = None
+
+from reptly.aptly import Aptly, AptlyApi, SnapshotMeta, parse_package_key, \
+    parse_time
+
+
+# key prefixes of aptly records
+PREFIXES = {
+    'mirror': b'R',
+    'repo': b'L',
+    'snapshot': b'S',
+}
+# SourceKind of snapshots to reptly source types
+SOURCE_KINDS = {
+    'repo': 'mirror',
+    'local': 'repo',
+    'snapshot': 'snapshot',
+}
+
+
+def text(value):
+    # old msgpack encoders do not distinguish between strings and bytes
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'surrogateescape')
+    return value
+
+
+def decode_time(value):
+    ''' Decode a time.Time as stored by aptly into a local naive datetime.
+
+        aptly's msgpack codec stores times in the binc format: a descriptor
+        byte (bits: secs present, nsecs present, tz present, 3 bits secs
+        length - 1, 2 bits nsecs length - 1) followed by big endian secs
+        since the epoch, nsecs and the time zone offset.
+    '''
+    if isinstance(value, msgpack.Timestamp):
+        return datetime.datetime.fromtimestamp(value.to_unix())
+    if isinstance(value, str):
+        return parse_time(value)
+    if not value:
+        return datetime.datetime.fromtimestamp(0)
+    descriptor = value[0]
+    pos = 1
+    secs = nsecs = 0
+    if descriptor & 0x80:
+        length = ((descriptor >> 2) & 0x07) + 1
+        secs = int.from_bytes(value[pos:pos + length], 'big', signed=True)
+        pos += length
+    if descriptor & 0x40:
+        length = (descriptor & 0x03) + 1
+        nsecs = int.from_bytes(value[pos:pos + length], 'big')
+    return datetime.datetime.fromtimestamp(secs + nsecs / 1e9)
+
+
+def decode(value: bytes):
+    record = msgpack.unpackb(value, raw=True, strict_map_key=False)
+    return {text(key): item for key, item in record.items()}
+
+
+class DatabaseLocked(Exception):
+    ''' aptly is using (and possibly changing) its database '''
+
+
+class AptlyDatabase():
+    ''' Decoder of the snapshot, mirror, repo and publication records
+
+        The records are read from a checkpoint (a copy of the database
+        files; tables are hard-linked as LevelDB never changes them). It
+        is opened once and renewed only after aptly changed the database.
+    '''
+    def __init__(self, path: str):
+        if plyvel is None:
+            raise RuntimeError('reading the aptly database directly '
+                               'requires plyvel and msgpack')
+        self.path = path
+        self._names = None
+        self._db = None
+        self._checkpoint = None
+        self._signature = None
+
+    def open(self):
+        ''' The checkpoint of the current database content; raises
+            DatabaseLocked while aptly uses the database
+        '''
+        with self._locked():
+            signature = self._files()
+            if signature != self._signature:
+                self.close()
+                self._checkpoint = tempfile.mkdtemp(prefix='reptly-db-')
+                for name, _, _ in signature:
+                    self._copy(name)
+                self._signature = signature
+        if self._db is None:
+            self._db = plyvel.DB(self._checkpoint, create_if_missing=False)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._checkpoint is not None:
+            shutil.rmtree(self._checkpoint, ignore_errors=True)
+            self._checkpoint = None
+            self._signature = None
+
+    def _locked(self):
+        ''' Share the lock of aptly's database (like a read-only
+            goleveldb): aptly cannot change the files meanwhile
+        '''
+        try:
+            lock = open(os.path.join(self.path, 'LOCK'), 'rb')
+        except FileNotFoundError:  # never opened by aptly
+            lock = open(os.devnull, 'rb')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise DatabaseLocked(self.path)
+        return lock
+
+    def _files(self):
+        ''' (name, size, mtime) of the database files: changes with every
+            write of aptly
+        '''
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name not in ('LOCK', 'LOG', 'LOG.old'):
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return sorted(files)
+
+    def _copy(self, name: str):
+        source = os.path.join(self.path, name)
+        target = os.path.join(self._checkpoint, name)
+        if name.endswith(('.ldb', '.sst')):  # immutable tables
+            try:
+                os.link(source, target)
+                return
+            except OSError:  # e.g. another file system
+                pass
+        shutil.copy2(source, target)
+
+    def _records(self, db, prefix: bytes):
+        for _, value in db.iterator(prefix=prefix):
+            yield decode(value)
+
+    def _load_names(self, db):
+        ''' Map the UUIDs of all mirrors, repos and snapshots to
+            (type, name)
+        '''
+        self._names = {}
+        for type, prefix in PREFIXES.items():
+            for record in self._records(db, prefix):
+                self._names[text(record['UUID'])] = \
+                    (type, text(record['Name']))
+
+    def _name(self, db, uuid):
+        if self._names is None or uuid not in self._names:
+            self._load_names(db)
+        return self._names.get(uuid, (None, None))[1]
+
+    def _uuid(self, db, type, name):
+        for refresh in (False, True):
+            if self._names is None or refresh:
+                self._load_names(db)
+            for uuid, entry in self._names.items():
+                if entry == (type, name):
+                    return uuid
+        raise KeyError(f'{type} {name} not found in the aptly database')
+
+    def names(self, type: str):
+        db = self.open()
+        return sorted(text(record['Name'])
+                      for record in self._records(db, PREFIXES[type]))
+
+    def snapshot_meta(self, names=None):
+        db = self.open()
+        records = list(self._records(db, PREFIXES['snapshot']))
+        if names is not None:
+            names = set(names)
+            records = [record for record in records
+                       if text(record['Name']) in names]
+        return [self._snapshot_meta(db, record) for record in records]
+
+    def _snapshot_meta(self, db, record):
+        kind = SOURCE_KINDS.get(text(record.get('SourceKind')))
+        sources = tuple((kind, self._name(db, text(uuid)))
+                        for uuid in record.get('SourceIDs') or ())
+        return SnapshotMeta(text(record['Name']),
+                            text(record.get('Description', '')),
+                            decode_time(record.get('CreatedAt')), sources)
+
+    def snapshot_packages(self, name: str):
+        db = self.open()
+        refs = db.get(b'E' + self._uuid(db, 'snapshot', name).encode())
+        if refs is None:
+            return []
+        return sorted(parse_package_key(text(ref))
+                      for ref in decode(refs).get('Refs') or ())
+
+    def publications(self):
+        db = self.open()
+        return [self._publication(db, record)
+                for record in self._records(db, b'U')]
+
+    def publication(self, target: str, distribution: str):
+        db = self.open()
+        value = db.get(f'U{target}>>{distribution}'.encode())
+        if value is None:
+            return None
+        return self._publication(db, decode(value))
+
+    def _publication(self, db, record):
+        ''' Convert a record into the format of the aptly API '''
+        sources = record.get('Sources') or {
+            record.get('Component', 'main'): record.get('SourceUUID')}
+        return {
+            'Storage': text(record.get('Storage', '')),
+            'Prefix': text(record['Prefix']),
+            'Distribution': text(record['Distribution']),
+            'SourceKind': text(record.get('SourceKind')),
+            'Sources': [{'Component': text(component),
+                         'Name': self._name(db, text(uuid))}
+                        for component, uuid in sorted(sources.items())],
+        }
+
+
+class DatabaseReads():
+    ''' Backend mixin answering read-only queries from the aptly database.
+        Reads fall back to aptly while another aptly process holds the
+        database lock.
+    '''
+    def __init__(self, *args, db: AptlyDatabase, **kwargs):
+        self.db = db
+        super().__init__(*args, **kwargs)
+
+    def _read(self, method, fallback, *args):
+        try:
+            with self.lock:
+                return method(*args)
+        except DatabaseLocked:
+            return fallback(*args)
+
+    def get_raw_list(self, type):
+        return self._read(self.db.names, super().get_raw_list, type)
+
+    def fetch_snapshot_meta(self, names):
+        return self._read(self.db.snapshot_meta,
+                          super().fetch_snapshot_meta, names)
+
+    def fetch_snapshot_packages(self, name: str):
+        return self._read(self.db.snapshot_packages,
+                          super().fetch_snapshot_packages, name)
+
+    def fetch_publications(self):
+        return self._read(self.db.publications, super().fetch_publications)
+
+    def fetch_publication(self, target: str, distribution: str):
+        return self._read(self.db.publication, super().fetch_publication,
+                          target, distribution)
+
+
+class AptlyDb(DatabaseReads, Aptly):
+    pass
+
+
+class AptlyApiDb(DatabaseReads, AptlyApi):
+    pass
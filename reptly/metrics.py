@@ -0,0 +1,145 @@
+''' Prometheus metrics of a run as node_exporter textfile
+
+Durations and call counts are derived from the trace records (see
+reptly.trace), update results and snapshot counts from the App.
+'''
+import collections
+import os
+import re
+import tempfile
+import time
+
+from reptly.domain import Merge, Mirror, Repo
+
+
+def escape(value: str):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def changed_packages(update):
+    ''' Number of packages added, removed or changed by an update '''
+    if not update:
+        return 0
+    if update.old.rev == 0:  # first snapshot: snapshot info
+        match = re.search(r'^Number of packages: (\d+)$', update.diff,
+                          re.MULTILINE)
+        return int(match.group(1)) if match else 0
+    return diff_size(update.diff)
+
+
+def diff_size(diff: str):
+    ''' Number of package lines of a snapshot diff '''
+    return sum(1 for line in (diff or '').split('\n')
+               if line[:1] in ('+', '-', '!'))
+
+
+def operation(record):
+    ''' Operation name of a trace record with low cardinality
+        (`aptly snapshot create`, `GET /api/snapshots`)
+    '''
+    if record.kind == 'http':
+        method, path = record.name.split(' ', 1)
+        return method + ' ' + '/'.join(path.split('/')[:3])
+    return record.name
+
+
+class Metrics():
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+
+    def set(self, name: str, value, help: str, **labels):
+        if name not in self.metrics:
+            self.metrics[name] = (help, collections.OrderedDict())
+        key = tuple(sorted(labels.items()))
+        self.metrics[name][1][key] = value
+
+    def add(self, name: str, value, help: str, **labels):
+        key = tuple(sorted(labels.items()))
+        current = self.metrics.get(name, (None, {}))[1].get(key, 0)
+        self.set(name, current + value, help, **labels)
+
+    def collect_run(self, duration: float, success: bool):
+        self.set('reptly_run_duration_seconds', round(duration, 3),
+                 'Duration of the reptly run')
+        self.set('reptly_run_success', int(success),
+                 'Whether the reptly run succeeded')
+        self.set('reptly_run_timestamp_seconds', int(time.time()),
+                 'End of the reptly run')
+
+    def collect_trace(self, tracer):
+        for record in tracer.records:
+            if record.kind == 'phase':
+                if record.name == 'update' and record.alias:
+                    self.add('reptly_source_update_duration_seconds',
+                             record.duration,
+                             'Duration of the source update (mirror update '
+                             'and snapshot)', source=record.alias)
+                elif record.name == 'switch' and record.alias:
+                    self.add('reptly_publication_switch_duration_seconds',
+                             record.duration,
+                             'Duration of switching the publication',
+                             publication=record.alias)
+                elif record.name == 'publish' and record.alias:
+                    self.add('reptly_publication_duration_seconds',
+                             record.duration,
+                             'Duration of the publication step (diff, '
+                             'questions, switch)', publication=record.alias)
+                continue
+            self.add('reptly_aptly_calls', 1,
+                     'aptly commands and API requests of the run',
+                     operation=operation(record))
+            self.add('reptly_aptly_call_duration_seconds', record.duration,
+                     'Time spent in aptly commands and API requests',
+                     operation=operation(record))
+
+    def collect_app(self, app):
+        for source, update in app.updates.items():
+            self.set('reptly_source_changed_packages',
+                     changed_packages(update),
+                     'Packages added, removed or changed by the update',
+                     source=source.name)
+            downloaded = getattr(source, 'downloaded', None)
+            if downloaded is not None:
+                self.set('reptly_source_downloaded_bytes', downloaded,
+                         'Bytes downloaded by the mirror update',
+                         source=source.name)
+        sources = list(Mirror.mirrors.values()) + list(Repo.repos.values())
+        sources.extend(source for p in app.publications
+                       for source in p.components.values()
+                       if type(source) is Merge)
+        for source in sources:
+            if source in app.linked:  # snapshots are known
+                self.set('reptly_source_snapshots', len(source.snapshots),
+                         'Snapshots of the source', source=source.name)
+
+    def render(self):
+        lines = []
+        for name, (help, samples) in self.metrics.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples.items():
+                if labels:
+                    label = ','.join(f'{key}="{escape(label_value)}"'
+                                     for key, label_value in labels)
+                    lines.append(f'{name}{{{label}}} {value}')
+                else:
+                    lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        ''' Write the textfile atomically: node_exporter must never read
+            a partial file
+        '''
+        directory = os.path.dirname(os.path.abspath(path))
+        # node_exporter only reads *.prom files
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.reptly-',
+                                   suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
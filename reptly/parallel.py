@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextlib
+import threading
+
+
+class HostLimiter():
+    ''' Limit the number of concurrent operations per upstream host '''
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.slots = {}
+
+    @contextlib.contextmanager
+    def __call__(self, host):
+        if host is None:  # e.g. local repos
+            yield
+            return
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.limit)
+            slot = self.slots[host]
+        with slot:
+            yield
+
+
+class DeferredOutput():
+    ''' Output of worker threads that must not interrupt a dialog: while
+        a dialog (e.g. questions of a publication) is open, the output is
+        buffered and printed once it is closed
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()  # held by the open dialog
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+    def write(self, text: str):
+        with self.pending_lock:
+            self.pending.append(text)
+        self.flush()
+
+    @contextlib.contextmanager
+    def dialog(self):
+        ''' Open a dialog (one at a time) '''
+        with self.lock:
+            self._print()
+            yield
+        self.flush()
+
+    def flush(self):
+        ''' Print the buffered output unless a dialog is open '''
+        if self.lock.acquire(blocking=False):
+            try:
+                self._print()
+            finally:
+                self.lock.release()
+
+    def _print(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        for text in pending:
+            print(text)
+
+
+def run_parallel(func, items, jobs: int):
+    ''' Call func for every item with up to jobs worker threads.
+        Yields (item, future) pairs in order of completion.
+    '''
+    with ThreadPoolExecutor(jobs) as pool:
+        futures = {pool.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future
+
+
+class Graph():
+    ''' Tasks with dependencies on each other
+
+        A task is started as soon as all tasks it depends on are done.
+        Tasks without function only join their dependencies.
+    '''
+    def __init__(self):
+        self.tasks = {}
+
+    def __contains__(self, key):
+        return key in self.tasks
+
+    def add(self, key, func, deps=()):
+        deps = [dep for dep in deps if dep in self.tasks]
+        self.tasks[key] = (func, deps)
+
+    def run(self, jobs: int):
+        ''' Run all tasks with up to jobs worker threads.
+            Tasks depending on a failed task are skipped; the first
+            error is raised after all other tasks have finished.
+        '''
+        if jobs <= 1:  # keep it simple: run in order of definition
+            for func, _deps in self.tasks.values():
+                if func:
+                    func()
+            return
+
+        waiting = {key: set(deps) for key, (_func, deps) in self.tasks.items()}
+        dependents = {key: [] for key in self.tasks}
+        for key, deps in waiting.items():
+            for dep in deps:
+                dependents[dep].append(key)
+        errors = []
+        running = {}
+
+        def skip(key):
+            for dependent in dependents[key]:
+                if dependent in waiting:
+                    del waiting[dependent]
+                    skip(dependent)
+
+        with ThreadPoolExecutor(jobs) as pool:
+            while waiting or running:
+                for key, deps in list(waiting.items()):
+                    if deps:
+                        continue
+                    del waiting[key]
+                    func = self.tasks[key][0] or (lambda: None)
+                    running[pool.submit(func)] = key
+                done = next(as_completed(running))
+                key = running.pop(done)
+                if done.exception():
+                    errors.append(done.exception())
+                    skip(key)
+                    continue
+                for dependent in dependents[key]:
+                    if dependent in waiting:
+                        waiting[dependent].discard(key)
+        if errors:
+            raise errors[0]
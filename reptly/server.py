@@ -0,0 +1,144 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+
+class UnixConnection(HTTPConnection):
+    def __init__(self, path: str, **kwargs):
+        super().__init__('localhost', **kwargs)
+        self.socket_path = path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class UnixConnectionPool(HTTPConnectionPool):
+    ConnectionCls = UnixConnection
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__('localhost', **kwargs)
+        self.socket_path = path
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return UnixConnection(self.socket_path,
+                              timeout=self.timeout.connect_timeout)
+
+
+class UnixAdapter(HTTPAdapter):
+    ''' Transport adapter sending all requests to a unix domain socket
+        (the host part of the URL is ignored). Connections are kept
+        alive and reused.
+    '''
+    def __init__(self, path: str, maxsize: int = 10):
+        self.socket_path = path
+        super().__init__(pool_maxsize=maxsize)
+        self.pool = UnixConnectionPool(path, maxsize=maxsize)
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def get_connection_with_tls_context(self, request, verify,
+                                        proxies=None, cert=None):
+        return self.pool
+
+    def close(self):
+        super().close()
+        self.pool.close()
+
+
+class ApiServer():
+    ''' Private `aptly api serve` listening on a unix domain socket
+
+        Use it as context manager: the server is started and awaited on
+        enter and stopped on exit. `url` and `session` are meant for
+        Aptly/AptlyApi. As the server is started with `-no-lock`, aptly
+        commands can still be executed while it is running.
+    '''
+    url = 'http://aptly'
+
+    def __init__(self, *, timeout: float = 10):
+        self.timeout = timeout
+        self.directory = None
+        self.process = None
+        self.session = None
+
+    @property
+    def socket_path(self):
+        return os.path.join(self.directory, 'aptly.sock')
+
+    @property
+    def log_path(self):
+        return os.path.join(self.directory, 'aptly.log')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix='reptly-')
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen(
+                ['aptly', 'api', 'serve', '-no-lock',
+                 '-listen=unix://' + self.socket_path],
+                stdout=log, stderr=subprocess.STDOUT)
+        self.session = requests.Session()
+        self.session.mount(self.url + '/', UnixAdapter(self.socket_path))
+        try:
+            self.wait()
+        except BaseException:
+            self.stop()
+            raise
+
+    def wait(self):
+        ''' Block until the server answers API requests '''
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.process.poll() is not None:
+                with open(self.log_path, 'r') as log:
+                    raise RuntimeError(
+                        f'aptly api serve exited '
+                        f'({self.process.returncode}): {log.read().strip()}')
+            if os.path.exists(self.socket_path):
+                try:
+                    self.session.get(self.url + '/api/version',
+                                     timeout=1).raise_for_status()
+                    return
+                except requests.RequestException:
+                    pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'aptly api serve did not get ready '
+                                   f'within {self.timeout} seconds')
+            time.sleep(0.05)
+
+    def stop(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(self.timeout)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,47 @@
+''' Wall-clock and CPU time per phase of a run (`reptly --profile`)
+
+Only the outermost phases (load, link, update, publish) are timed. CPU
+time is the time spent by the thread executing the phase, i.e. reptly's
+own Python work - waiting for aptly is only part of the wall-clock time.
+Phases running in parallel (--jobs) are summed up.
+'''
+import threading
+import time
+
+
+timer = None  # the enabled PhaseTimer
+
+
+class PhaseTimer():
+    def __init__(self):
+        self.phases = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def add(self, name: str, wall: float, cpu: float):
+        with self.lock:
+            calls, total_wall, total_cpu = self.phases.get(name, (0, 0, 0))
+            self.phases[name] = (calls + 1, total_wall + wall,
+                                 total_cpu + cpu)
+
+    def report(self):
+        rows = [('phase', 'calls', 'wall [s]', 'cpu [s]')]
+        for name, (calls, wall, cpu) in self.phases.items():
+            rows.append((name, str(calls), f'{wall:.3f}', f'{cpu:.3f}'))
+        rows.append(('total', '', f'{time.perf_counter() - self.start:.3f}',
+                     f'{time.process_time() - self.start_cpu:.3f}'))
+        width = max(len(row[0]) for row in rows)
+        return ''.join(f'{row[0]:<{width}}  {row[1]:>5}  {row[2]:>9}  '
+                       f'{row[3]:>8}\n' for row in rows)
+
+
+def enable():
+    global timer
+    timer = PhaseTimer()
+    return timer
+
+
+def disable():
+    global timer
+    timer = None
@@ -0,0 +1,178 @@
+''' Tracing of aptly invocations (commands and API requests)
+
+Every operation is recorded with its arguments, duration, exit status
+and output size, tagged with the enclosing phase (load, link, update,
+merge, diff, switch, publish) and the alias of the source or publication. Tracing is
+disabled unless a Tracer is enabled (`reptly --trace FILE`).
+'''
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import types
+
+from reptly import timing
+
+_phase = contextvars.ContextVar('phase', default=None)
+_alias = contextvars.ContextVar('alias', default=None)
+
+tracer = None  # the enabled Tracer
+
+
+class Record():
+    __slots__ = ('kind', 'name', 'args', 'start', 'end', 'status', 'size',
+                 'phase', 'alias', 'tid')
+
+    def __init__(self, kind, name, args):
+        self.kind = kind
+        self.name = name
+        self.args = args
+        self.start = self.end = time.perf_counter()
+        self.status = None
+        self.size = 0
+        self.phase = _phase.get()
+        self.alias = _alias.get()
+        self.tid = current_tid()
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    @property
+    def label(self):
+        if self.kind == 'command':
+            return ' '.join(['aptly'] + [arg for arg in self.args if arg])
+        return self.name
+
+
+def current_tid():
+    ''' Thread or asyncio task executing the operation '''
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:  # no running event loop
+        task = None
+    return id(task) if task else threading.get_ident()
+
+
+@contextlib.contextmanager
+def phase(name: str, alias: str = None):
+    ''' Tag all operations within the block with the phase (and alias;
+        the enclosing alias is kept if none is given)
+    '''
+    timed = timing.timer is not None and _phase.get() is None
+    if timed:
+        wall, cpu = time.perf_counter(), time.thread_time()
+    phase_token = _phase.set(name)
+    alias_token = _alias.set(alias) if alias is not None else None
+    record = Record('phase', name, ()) if tracer else None
+    try:
+        yield
+    finally:
+        if timed:
+            timing.timer.add(name, time.perf_counter() - wall,
+                             time.thread_time() - cpu)
+        if record:
+            record.end = time.perf_counter()
+            tracer.add(record)
+        if alias_token:
+            _alias.reset(alias_token)
+        _phase.reset(phase_token)
+
+
+@contextlib.contextmanager
+def span(kind: str, name: str, args=()):
+    ''' Record an operation; the caller fills status and size of the
+        yielded record
+    '''
+    if tracer is None:
+        yield types.SimpleNamespace()
+        return
+    record = Record(kind, name, args)
+    try:
+        yield record
+    finally:
+        record.end = time.perf_counter()
+        if tracer:
+            tracer.add(record)
+
+
+def command_name(args):
+    ''' aptly subcommand of the arguments (e.g. `snapshot create`) '''
+    words = [arg for arg in args if arg and not arg.startswith('-')]
+    return 'aptly ' + ' '.join(words[:2])
+
+
+class Tracer():
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def add(self, record: Record):
+        with self.lock:
+            self.records.append(record)
+
+    def operations(self):
+        return [record for record in self.records if record.kind != 'phase']
+
+    def chrome_trace(self):
+        ''' Trace in the Chrome trace event format (chrome://tracing,
+            ui.perfetto.dev)
+        '''
+        pid = os.getpid()
+        events = []
+        for record in sorted(self.records, key=lambda r: r.start):
+            args = {'phase': record.phase, 'alias': record.alias}
+            if record.kind != 'phase':
+                args.update(args=list(record.args), status=record.status,
+                            bytes=record.size)
+            events.append({
+                'name': record.name,
+                'cat': record.kind,
+                'ph': 'X',
+                'ts': round((record.start - self.start) * 1e6),
+                'dur': round(record.duration * 1e6),
+                'pid': pid,
+                'tid': record.tid,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self, limit: int = 10):
+        ''' Table of the slowest operations '''
+        operations = sorted(self.operations(), key=lambda r: r.duration,
+                            reverse=True)[:limit]
+        if not operations:
+            return ''
+        rows = [('seconds', 'phase', 'alias', 'status', 'operation')]
+        for record in operations:
+            rows.append((f'{record.duration:.3f}', record.phase or '-',
+                         record.alias or '-', str(record.status),
+                         record.label))
+        widths = [max(len(row[i]) for row in rows) for i in range(4)]
+        lines = []
+        for row in rows:
+            lines.append('  '.join(
+                [row[0].rjust(widths[0])] +
+                [cell.ljust(width) for cell, width in zip(row[1:4],
+                                                          widths[1:])] +
+                [row[4]]))
+        return '\n'.join(lines) + '\n'
+
+
+def enable():
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def disable():
+    global tracer
+    tracer = None
@@ -74,7 +74,7 @@ class PromptToolkitUi():
         print()
         print(f'\033[01;32m{mirror.name}\033[0m')
         print('='*len(mirror.name))
-        action()
+        return action()
 
     def prepare_switch(self, publish, component):
         self.current_switch = (publish, component)
@@ -124,7 +124,7 @@ class PromptToolkitUi():
 
 class CronUI():
     def mirror_update(self, mirror, action):
-        action(quiet=True)
+        return action(quiet=True)
 
     def include_snapshot(self, snapshot, info):
         return snapshot
@@ -58,8 +58,13 @@ setup(
     install_requires=[
         'prompt_toolkit',
         'pygments',
+        'requests',
         'yaml',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'leveldb': ['msgpack', 'plyvel'],
+    },
 
     scripts=['bin/reptly'],
 )
@@ -1,4 +1,6 @@
+import datetime
 import os
+import threading
 from typing import List
 import sys
 
@@ -11,6 +13,7 @@ if os.path.isdir(os.path.join(parent, 'reptly')):
 
 
 from reptly.app import App
+from reptly.aptly import SnapshotIndex
 from reptly.domain import Mirror, Repo
 from reptly.ui import CronUI
 
@@ -21,13 +24,27 @@ class Testly():
         self.repos = []
         self.snapshots = []
         self.publications = {}
+        self.mirror_urls = {}
+        self.mirror_states = {}
+        self.snapshot_states = {}
+        self.merges = {}
+        self.predictable = False
+        self.created = {}
         self.pending_ops = []
+        # parallel updates: accept scheduled operations in any order
+        self.unordered = False
+        self.lock = threading.Lock()
+
+    def prefetch(self, *types):
+        self.prefetched = types
 
     def register_snapshot(self, name):
         self.snapshots.append(name)
 
-    def register_mirror(self, name: str, *, snapshots: List[int]=[]):
+    def register_mirror(self, name: str, *, snapshots: List[int]=[],
+                        url: str = 'http://deb.debian.org/debian'):
         self.mirrors.append(name)
+        self.mirror_urls[name] = url
         for snapshot in snapshots:
             self.snapshots.append(f'{name}+r{snapshot}')
 
@@ -48,10 +65,19 @@ class Testly():
         }
 
     def run(self, *args):
-        op, ret = self.pending_ops.pop(0)
+        with self.lock:
+            index = 0
+            if self.unordered:
+                ops = [op for op, _ in self.pending_ops]
+                assert args in ops
+                index = ops.index(args)
+            op, ret = self.pending_ops.pop(index)
         assert op == args
         return ret
 
+    def snapshot_revisions(self, base: str):
+        return SnapshotIndex(self.snapshots).get(base)
+
     def publication(self, name, distribution):
         return self.publications.get((name, distribution), None)
 
@@ -61,6 +87,15 @@ class Testly():
     def snapshot_drop(self, name: str, check: bool = True):
         return self.run('snapshot_drop', name, check)
 
+    def snapshot_drop_batch(self, names):
+        return self.run('snapshot_drop_batch', *names) or []
+
+    def snapshot_created(self, name: str):
+        return self.created.get(name, datetime.datetime(2019, 1, 1))
+
+    def db_cleanup(self):
+        return self.run('db_cleanup')
+
     def snapshot_mirror(self, snapshot: str, mirror: str):
         return self.run('snapshot_mirror', snapshot, mirror)
 
@@ -73,12 +108,36 @@ class Testly():
     def snapshot_merge(self, name, sources, *, latest=False):
         return self.run('snapshot_merge', name, latest, *sources)
 
+    def plan_merge(self, name, sources, latest):
+        return self.predictable
+
+    def drop_plan(self, name):
+        pass
+
+    def merged_snapshot(self, base, sources, latest):
+        return self.merges.get((base, tuple(sources), latest))
+
     def snapshot_sources(self, name: str):
         return self.run('snapshot_sources', name)
 
+    def want_snapshot_meta(self, names):
+        pass
+
     def mirror_update(self, name: str, *, quiet: bool = False):
         return self.run('mirror_update', name, quiet)
 
+    def mirror_url(self, name: str):
+        return self.mirror_urls[name]
+
+    def mirror_state(self, name: str):
+        return self.mirror_states.get(name)
+
+    def snapshot_state(self, name: str):
+        return self.snapshot_states.get(name)
+
+    def remember_snapshot_state(self, name: str, state: str):
+        self.snapshot_states[name] = state
+
     def publish(self, distro: str, target: str, content: dict, *,
                 architectures: List[str] = None,
                 acquire_by_hash: bool = True):
@@ -92,6 +151,54 @@ class Testly():
         self.run('switch_components', distro, target, changes)
 
 
+class AsyncTestly():
+    ''' AsyncAptly counterpart of Testly: awaitable operations are
+        recorded in the op queue of the wrapped Testly
+    '''
+    def __init__(self, aptly, *, jobs=8):
+        self.aptly = aptly
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    async def mirror_update(self, name: str):
+        return self.aptly.mirror_update(name, quiet=True)
+
+    async def mirror_url(self, name: str):
+        return self.aptly.mirror_url(name)
+
+    async def mirror_state(self, name: str):
+        return self.aptly.mirror_state(name)
+
+    async def snapshot_mirror(self, snapshot: str, mirror: str):
+        return self.aptly.snapshot_mirror(snapshot, mirror)
+
+    async def snapshot_repo(self, snapshot: str, repo: str):
+        return self.aptly.snapshot_repo(snapshot, repo)
+
+    async def snapshot_merge(self, name, sources, *, latest=False):
+        return self.aptly.snapshot_merge(name, sources, latest=latest)
+
+    async def snapshot_drop(self, name: str, check: bool = True):
+        return self.aptly.snapshot_drop(name, check)
+
+    async def publish(self, distro: str, target: str, content: dict, *,
+                      architectures: List[str] = None,
+                      acquire_by_hash: bool = True):
+        return self.aptly.publish(distro, target, content,
+                                  architectures=architectures,
+                                  acquire_by_hash=acquire_by_hash)
+
+    async def switch_components(self, distro, target, changes):
+        return self.aptly.switch_components(distro, target, changes)
+
+
 class TestUI():
     def __init__(self):
         self.decisions = {}
@@ -108,7 +215,7 @@ class TestUI():
             return no
 
     def mirror_update(self, mirror, action):
-        action(quiet=True)
+        return action(quiet=True)
 
     def include_snapshot(self, snapshot, info):
         return self.act('include_snapshot', snapshot.name, snapshot, False)
@@ -0,0 +1,314 @@
+import asyncio
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from reptly import trace
+from reptly.aio import AsyncAptly
+from reptly.aptly import Aptly
+
+from conftest import AsyncTestly
+
+
+class Namespace():
+    def __init__(self, target, jobs=4):
+        self.target = target
+        self.cron = True
+        self.jobs = jobs
+        self.jobs_per_host = 2
+        self.order = None
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def asyncly(monkeypatch):
+    monkeypatch.setattr('reptly.app.AsyncAptly', AsyncTestly)
+
+
+CONFIG = '''publish:
+  - alias: 'sw1'
+    destination: s3:apt:sw1
+    distribution: distro
+    component: main
+    source: !mirror sw1
+  - alias: 'sw2'
+    destination: s3:apt:sw2
+    distribution: distro
+    component: main
+    source: !mirror sw2'''
+
+
+def test_update_concurrently(app, aptly, asyncly, capsys):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    app.load(CONFIG)
+    aptly.unordered = True
+
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret='Diff sw1')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw2+r2', True, ret=True)
+
+    run(app.aexec_update(Namespace([])))
+    assert aptly.pending_ops == []
+    assert capsys.readouterr().out == 'sw1\n---\nDiff sw1\n'
+
+
+def test_run_publishes_after_updates(app, aptly, asyncly):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_publication('s3:apt:sw1', 'distro', main='sw1+r1')
+    app.load(CONFIG)
+
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw1+r2', True, ret=True)
+
+    run(app.aexec_run(Namespace(['sw1'])))
+    assert aptly.pending_ops == []
+
+
+def test_failed_update_is_reported(app, aptly, asyncly, capsys):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    app.load(CONFIG)
+
+    def mirror_update(name, *, quiet=False):
+        raise subprocess.CalledProcessError(1, ['aptly'], stderr=b'404')
+    aptly.mirror_update = mirror_update
+
+    with pytest.raises(subprocess.CalledProcessError):
+        run(app.aexec_update(Namespace(['sw1'])))
+    assert '404' in capsys.readouterr().out
+
+
+def test_run_reports_failed_updates(app, aptly, asyncly, capsys):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_publication('s3:apt:sw1', 'distro', main='sw1+r1')
+    app.load(CONFIG)
+
+    def mirror_update(name, *, quiet=False):
+        raise subprocess.CalledProcessError(1, ['aptly'], stderr=b'404')
+    aptly.mirror_update = mirror_update
+
+    with pytest.raises(subprocess.CalledProcessError):
+        run(app.aexec_run(Namespace(['sw1'])))
+    assert 'sw1\n---\nUpdate failed: ' in capsys.readouterr().out
+
+
+def test_failed_api_request_is_reported(app, aptly, asyncly, capsys):
+    aiohttp = pytest.importorskip('aiohttp')
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    app.load(CONFIG)
+    aptly.unordered = True
+
+    url = aiohttp.client.URL('http://localhost:8080/api/mirrors')
+    request = aiohttp.RequestInfo(url, 'POST', {}, url)
+
+    def snapshot_mirror(snapshot, mirror):
+        if mirror == 'sw1':
+            raise aiohttp.ClientResponseError(request, (), status=500,
+                                              message='database locked')
+        return aptly.run('snapshot_mirror', snapshot, mirror)
+    aptly.snapshot_mirror = snapshot_mirror
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret='Diff sw2')
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        run(app.aexec_update(Namespace([])))
+    out = capsys.readouterr().out
+    assert 'sw1\n---\nUpdate failed: 500, message=\'database locked\'' in out
+    assert 'sw2\n---\nDiff sw2\n' in out
+    assert aptly.pending_ops == []
+
+
+FAKE_APTLY = '''#!{python}
+import sys
+
+args = sys.argv[1:]
+if args[:2] == ['mirror', 'show']:
+    print('Name: ' + args[2])
+    print('Archive Root URL: http://deb.debian.org/debian/')
+    sys.exit(0)
+if args[:2] != ['task', 'run']:
+    print(' '.join(args))
+    sys.exit(3 if 'fail' in args else 0)
+with open(args[2][len('-filename='):]) as f:
+    commands = f.read().splitlines()
+for index, command in enumerate(commands, 1):
+    print(f'{{index}}) [Running]: {{command}}')
+    print()
+    print('Begin command output: ---')
+    if command.startswith('snapshot show'):
+        print('Packages:')
+        print('  foo_1.0_amd64')
+    print()
+    print('End command output: ---')
+'''
+
+
+@pytest.fixture
+def fake_aptly(tmp_path, monkeypatch):
+    path = tmp_path / 'aptly'
+    path.write_text(FAKE_APTLY.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{tmp_path}:{os.environ["PATH"]}')
+
+
+def test_execute_subprocesses(fake_aptly):
+    async def main():
+        async with AsyncAptly(Aptly(), jobs=2) as aio:
+            results = await asyncio.gather(*[
+                aio.run('snapshot', 'drop', f'sw1+r{i}',
+                        stdout=subprocess.PIPE) for i in range(4)])
+            with pytest.raises(subprocess.CalledProcessError):
+                await aio.execute('mirror', 'update', 'fail')
+            return results
+
+    assert [result.stdout for result in run(main())] == [
+        f'snapshot drop sw1+r{i}\n'.encode() for i in range(4)]
+
+
+def test_snapshot_create_through_task_run(fake_aptly):
+    aptly = Aptly()
+    aptly._lists['snapshot'] = ['sw1+r1']
+
+    async def main():
+        async with AsyncAptly(aptly) as aio:
+            await aio.snapshot_mirror('sw1+r2', 'sw1')
+
+    run(main())
+    assert aptly.snapshots == ['sw1+r1', 'sw1+r2']
+    assert aptly.snapshot_packages('sw1+r2') == [('foo', '1.0', 'amd64')]
+
+
+def test_merge_and_drop_snapshots(fake_aptly):
+    aptly = Aptly()
+    aptly._lists['snapshot'] = ['sw1+r1', 'sw2+r1', 'fail']
+
+    async def main():
+        async with AsyncAptly(aptly) as aio:
+            await aio.snapshot_merge('m+r1', ['sw1+r1', 'sw2+r1'])
+            dropped = await asyncio.gather(
+                aio.snapshot_drop('sw1+r1'),
+                aio.snapshot_drop('fail', check=False))
+            return dropped
+
+    assert run(main()) == [True, False]
+    assert aptly.snapshots == ['sw2+r1', 'fail', 'm+r1']
+    assert list(aptly.snapshot_sources('m+r1')) == [
+        ('snapshot', 'sw1+r1'), ('snapshot', 'sw2+r1')]
+
+
+def test_mirror_show_without_blocking(fake_aptly):
+    aptly = Aptly()
+
+    async def main():
+        async with AsyncAptly(aptly) as aio:
+            return await asyncio.gather(aio.mirror_url('sw1'),
+                                        aio.mirror_state('sw1'))
+
+    url, state = run(main())
+    assert url == 'http://deb.debian.org/debian/'
+    assert state == aptly.mirror_state('sw1')
+
+
+def test_call_in_worker_thread(fake_aptly):
+    def probe():
+        return threading.get_ident(), trace._alias.get()
+
+    async def main():
+        async with AsyncAptly(Aptly()) as aio:
+            with trace.phase('update', 'sw1'):
+                return await aio.call(probe)
+
+    thread, alias = run(main())
+    assert thread != threading.get_ident()
+    assert alias == 'sw1'
+
+
+def test_commands_serialized_with_worker_threads(fake_aptly):
+    aptly = Aptly()
+    order = []
+
+    def command_in_thread(started):
+        with aptly.lock:
+            started.set()
+            order.append('thread')
+            time.sleep(0.05)
+
+    async def main():
+        async with AsyncAptly(aptly) as aio:
+            started = threading.Event()
+            thread = asyncio.ensure_future(
+                aio.call(command_in_thread, started))
+            await asyncio.get_event_loop().run_in_executor(None, started.wait)
+            async with aio.command_lock():
+                assert aptly.lock.locked()
+                order.append('async')
+            await thread
+        assert not aptly.lock.locked()
+
+    run(main())
+    assert order == ['thread', 'async']
+
+
+def test_publish_awaits_operations(app, aptly):
+    aptly.register_mirror('software1', snapshots=[1])
+    aptly.register_mirror('software2', snapshots=[1, 2])
+    aptly.register_snapshot('test-distro+r1')
+    aptly.register_publication('s3:apt:mon', 'distro', main='test-distro+r1')
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source:
+          - !mirror software1
+          - !mirror software2''')
+    questions = []
+    switch = app.ui.switch
+
+    def ask(*args, **kwargs):
+        questions.append(threading.get_ident())
+        return switch(*args, **kwargs)
+    app.ui.switch = ask
+
+    aptly.schedule('snapshot_sources', 'test-distro+r1', ret=[
+        ('snapshot', 'software1+r1'),
+        ('snapshot', 'software2+r1'),
+    ])
+    aptly.schedule('snapshot_diff', 'software2+r1', 'software2+r2', ret='D!')
+    aptly.schedule('snapshot_merge', 'test-distro+r2', True,
+                   'software1+r1', 'software2+r2')
+    aptly.schedule('snapshot_diff', 'test-distro+r1', 'test-distro+r2',
+                   ret='D!')
+    aptly.schedule('switch_components', 'distro', 's3:apt:mon',
+                   {'main': 'test-distro+r2'})
+    aptly.schedule('snapshot_drop', 'test-distro+r1', False)
+
+    publication, = app.publications
+    run(publication.publish_async(Namespace([]), AsyncTestly(aptly)))
+    assert aptly.pending_ops == []
+    assert len(questions) == 1 and questions[0] != threading.get_ident()
+    assert list(publication.switched) == ['main']
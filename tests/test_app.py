@@ -6,3 +6,60 @@ publish: []''')
 
     assert aptly.keyring == 'test'
     assert aptly.pending_ops == []
+
+
+def test_prefetch_only_needed_lists(app, aptly):
+    aptly.register_repo('pkgs', snapshots=[1])
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        source: !repo pkgs''')
+
+    assert aptly.prefetched == ('repo', 'snapshot')
+
+
+def test_prefetch_nothing_for_fix_snapshots(app, aptly):
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        source: !snapshot extern-managed''')
+
+    assert aptly.prefetched == ()
+
+
+class Namespace():
+    def __init__(self, action, target):
+        self.action = action
+        self.target = target
+        self.order = None
+
+
+TWO_PUBLICATIONS = '''publish:
+  - alias: 'repo'
+    destination: s3:apt:repo
+    distribution: distro
+    source: !repo pkgs
+  - alias: 'mirrors'
+    destination: s3:apt:mirrors
+    distribution: distro
+    source:
+      - !mirror sw1
+      - !mirror unknown'''
+
+
+def test_link_only_selected_publications(app, aptly):
+    aptly.register_repo('pkgs', snapshots=[1])
+    app.load(TWO_PUBLICATIONS, Namespace('publish', ['repo']))
+
+    assert aptly.prefetched == ('repo', 'snapshot')
+    assert [s.name for s in app.linked] == ['pkgs']
+
+
+def test_link_only_sources_to_update(app, aptly):
+    aptly.register_mirror('sw1', snapshots=[1, 2])
+    app.load(TWO_PUBLICATIONS, Namespace('update', ['sw1']))
+
+    assert aptly.prefetched == ('mirror', 'snapshot')
+    assert [(s.name, len(s.snapshots)) for s in app.linked] == [('sw1', 2)]
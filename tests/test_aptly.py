@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import subprocess
+import sys
+
+import pytest
+
+from reptly.aptly import Aptly, SnapshotIndex, parse_snapshot_show, \
+    parse_task_output, split_revision, task_run
+
+
+TASK_OUTPUT = '''1) [Running]: snapshot drop sw1+r1
+
+Begin command output: ----------------------------
+Snapshot `sw1+r1` has been dropped.
+
+End command output: ------------------------------
+2) [Running]: snapshot drop sw1+r2
+
+Begin command output: ----------------------------
+
+End command output: ------------------------------
+3) [Skipping]: snapshot drop sw1+r3
+'''
+
+SNAPSHOT_SHOW = '''Name: m+r2
+Created At: 2019-03-06 10:00:00 CET
+Description: Merged from sources: 'sw1+r1', 'pkgs+r2'
+Number of packages: 12
+Sources:
+  sw1+r1 [snapshot]
+  pkgs+r2 [snapshot]
+'''
+
+
+class TaskAptly(Aptly):
+    ''' CLI backend answering `aptly task run` from canned outputs '''
+    def __init__(self, outputs):
+        super().__init__()
+        self.outputs = outputs
+        self.calls = []
+
+    def execute(self, *args, **kwargs):
+        if args[2:3] and args[2].startswith('-filename='):
+            with open(args[2][len('-filename='):]) as f:
+                args = args[:2] + tuple(f.read().splitlines())
+        self.calls.append(args)
+        output, returncode = self.outputs.pop(0)
+        return subprocess.CompletedProcess(args, returncode,
+                                           output.encode('utf-8'))
+
+
+def test_split_revision():
+    assert split_revision('sw1+r12') == ('sw1', 12)
+    assert split_revision('sw+rc1+r2') == ('sw+rc1', 2)
+    assert split_revision('extern-managed') is None
+    assert split_revision('sw+rc') is None
+
+
+def test_index_revisions():
+    index = SnapshotIndex(['sw1+r10', 'sw1+r9', 'sw2+r1', 'sw1', 'other'])
+
+    assert index.get('sw1') == [9, 10]
+    assert index.get('sw2') == [1]
+    assert index.get('sw3') == []
+
+
+def test_index_incremental_update():
+    index = SnapshotIndex(['sw1+r1', 'sw1+r3'])
+    index.add('sw1+r2')
+    index.add('sw2+r1')
+    index.remove('sw1+r1')
+    index.remove('sw1+r7')
+
+    assert index.get('sw1') == [2, 3]
+    assert index.get('sw2') == [1]
+
+
+def test_parse_task_output():
+    commands = [['snapshot', 'drop', 'sw1+r{}'.format(i)] for i in (1, 2, 3)]
+    results = parse_task_output(commands, TASK_OUTPUT, 1)
+
+    assert [result.status for result in results] == \
+        ['ok', 'failed', 'skipped']
+    assert results[0].output == 'Snapshot `sw1+r1` has been dropped.\n'
+    assert results[1].output == ''
+    assert results[2].command == ['snapshot', 'drop', 'sw1+r3']
+
+
+def test_run_tasks_in_one_process():
+    aptly = TaskAptly([(TASK_OUTPUT.split('2)')[0], 0)])
+
+    assert [result.status for result in aptly.run_tasks(
+        [['snapshot', 'drop', 'sw1+r1', None]])] == ['ok']
+    assert aptly.calls == [('task', 'run', 'snapshot drop sw1+r1')]
+    assert aptly.run_tasks([]) == []
+
+
+def test_drop_batch_retries_skipped_commands():
+    aptly = TaskAptly([(TASK_OUTPUT, 1), (
+        '1) [Running]: snapshot drop sw1+r3\n\n'
+        'Begin command output: ---\n\nEnd command output: ---\n', 0)])
+
+    assert aptly.snapshot_drop_batch(['sw1+r1', 'sw1+r2', 'sw1+r3']) \
+        == ['sw1+r2']
+    assert aptly.calls == [
+        ('task', 'run', 'snapshot drop sw1+r1', 'snapshot drop sw1+r2',
+         'snapshot drop sw1+r3'),
+        ('task', 'run', 'snapshot drop sw1+r3'),
+    ]
+
+
+def test_task_run_passes_commands_in_file():
+    commands = [['snapshot', 'drop', f'sw1+r{i}'] for i in range(40000)]
+    with task_run(commands) as args:
+        assert args[:2] == ['task', 'run']
+        with open(args[2][len('-filename='):]) as f:
+            assert f.readline() == 'snapshot drop sw1+r0\n'
+            assert len(f.readlines()) == 39999
+    with task_run([['snapshot', 'show', 'a b'], ['db', 'cleanup']]) as args:
+        assert args == ['task', 'run', 'snapshot', 'show', 'a b,',
+                        'db', 'cleanup']
+
+
+def test_drop_batch_without_progress():
+    aptly = TaskAptly([('unexpected output\n', 0)])
+
+    assert aptly.snapshot_drop_batch(['sw1+r1', 'sw1+r2']) == \
+        ['sw1+r1', 'sw1+r2']
+    assert len(aptly.calls) == 1
+
+
+def test_run_tasks_raises_if_no_command_ran():
+    aptly = TaskAptly([('ERROR: can\'t open database\n', 1)])
+
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        aptly.snapshot_drop_batch(['sw1+r1'])
+    assert e.value.output == b'ERROR: can\'t open database\n'
+    assert len(aptly.calls) == 1
+
+
+def test_parse_snapshot_show():
+    meta = parse_snapshot_show(SNAPSHOT_SHOW)
+
+    assert meta.name == 'm+r2'
+    assert meta.created == datetime.datetime(2019, 3, 6, 10, 0, 0)
+    assert meta.description == "Merged from sources: 'sw1+r1', 'pkgs+r2'"
+    assert meta.sources == (('snapshot', 'sw1+r1'), ('snapshot', 'pkgs+r2'))
+
+
+def test_snapshot_metadata_fetched_at_once():
+    show = SNAPSHOT_SHOW.replace('m+r2', 'sw1+r1').replace(
+        'Sources:\n  sw1+r1 [snapshot]\n  pkgs+r2 [snapshot]',
+        'Sources:\n  sw1 [repo]')
+    aptly = TaskAptly([('sw1+r1\nm+r2\nother+r1\n', 0), (
+        '1) [Running]: snapshot show sw1+r1\n\n'
+        'Begin command output: ---\n' + show + '\nEnd command output: ---\n'
+        '2) [Running]: snapshot show m+r2\n\n'
+        'Begin command output: ---\n' + SNAPSHOT_SHOW +
+        '\nEnd command output: ---\n', 0)])
+
+    aptly.want_snapshot_meta(['sw1+r1', 'gone+r1'])
+    assert list(aptly.snapshot_sources('m+r2')) == [
+        ('snapshot', 'sw1+r1'), ('snapshot', 'pkgs+r2')]
+    assert list(aptly.snapshot_sources('sw1+r1')) == [('mirror', 'sw1')]
+    assert aptly.calls[1] == ('task', 'run', 'snapshot show m+r2',
+                              'snapshot show sw1+r1')
+    assert len(aptly.calls) == 2
+
+
+class EchoAptly(Aptly):
+    ''' CLI backend answering `aptly task run` by running every command
+        successfully; snapshots contain one package named like them
+    '''
+    def execute(self, *args, **kwargs):
+        with open(args[2][len('-filename='):]) as f:
+            commands = f.read().splitlines()
+        output = []
+        for index, command in enumerate(commands, 1):
+            output.append(f'{index}) [Running]: {command}\n\n'
+                          'Begin command output: ---')
+            if command.startswith('snapshot show'):
+                name = command.split()[-1]
+                output.append(SNAPSHOT_SHOW.replace('m+r2', name) +
+                              f'Packages:\n  {name}_1_all')
+            output.append('End command output: ---')
+        return subprocess.CompletedProcess(
+            args, 0, '\n'.join(output).encode('utf-8'))
+
+
+def test_concurrent_task_runs():
+    aptly = EchoAptly()
+    names = [f'sw{i}+r1' for i in range(8)]
+    shown = [f'old{i}+r1' for i in range(5000)]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible
+    try:
+        with ThreadPoolExecutor(len(names) + 1) as pool:
+            meta = pool.submit(aptly.fetch_snapshot_meta, shown)
+            list(pool.map(lambda name: aptly.snapshot_mirror(name, 'm'),
+                          names))
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert [m.name for m in meta.result()] == shown
+    for name in names:
+        assert aptly.snapshot_packages(name) == [(name, '1', 'all')]
+    assert sorted(name for _, name in aptly.changes) == sorted(names)
@@ -0,0 +1,244 @@
+import datetime
+import json
+
+import requests
+
+from reptly.aptly import Aptly, AptlyApi, api_prefix, \
+    parse_snapshot_description
+from reptly.cache import SnapshotCache
+
+
+class Response():
+    def __init__(self, data):
+        self.content = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.data = data
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class Session():
+    def __init__(self, **responses):
+        self.responses = {
+            'GET /api/mirrors': [{'Name': 'sw1'}],
+            'GET /api/repos': [{'Name': 'pkgs'}],
+            'GET /api/snapshots': [{
+                'Name': 'sw1+r1',
+                'CreatedAt': '2019-03-06T10:00:00.123456789+01:00',
+                'Description': 'Snapshot from mirror [sw1]: '
+                               'http://deb.debian.org/ buster',
+            }],
+        }
+        self.responses.update(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        path = url.split('://', 1)[1].split('/', 1)[1]
+        self.requests.append((method, '/' + path, kwargs))
+        response = self.responses.get(f'{method} /{path}')
+        if isinstance(response, Exception):
+            raise response
+        return Response(response)
+
+
+def test_load_lists_lazily():
+    session = Session()
+    aptly = AptlyApi(session=session)
+    assert session.requests == []
+
+    aptly.prefetch('mirror', 'snapshot')
+    assert len(session.requests) == 2
+    assert aptly.mirrors == ['sw1']
+    assert aptly.repos == ['pkgs']
+    assert aptly.snapshots == ['sw1+r1']
+
+
+def test_api_prefix():
+    assert api_prefix('s3:apt:mon') == 's3:apt:mon'
+    assert api_prefix('debian/main_x') == 'debian_main__x'
+    assert api_prefix('.') == '.'
+
+
+def test_parse_snapshot_description():
+    assert list(parse_snapshot_description(
+        "Merged from sources: 'sw1+r1', 'pkgs+r2'")) == [
+            ('snapshot', 'sw1+r1'), ('snapshot', 'pkgs+r2')]
+    assert list(parse_snapshot_description(
+        'Snapshot from mirror [sw1]: http://deb.debian.org/ buster')) == [
+            ('mirror', 'sw1')]
+    assert list(parse_snapshot_description(
+        'Snapshot from local repo [pkgs]')) == [('repo', 'pkgs')]
+    assert list(parse_snapshot_description('Created as empty')) == []
+
+
+def test_snapshot_diff():
+    session = Session(**{
+        'GET /api/snapshots/a/packages': [
+            'Pamd64 foo 1.0 abc', 'Pall baz 1 abc'],
+        'GET /api/snapshots/b/packages': [
+            'Pamd64 foo 1.1 def', 'Pall bar 2 abc', 'Pall baz 1 abc'],
+    })
+    aptly = AptlyApi(session=session)
+
+    diff = aptly.snapshot_diff('a', 'b')
+    assert diff.split('\n')[1].split() == [
+        '+', 'all', '|', 'bar', '|', '-', '|', '2']
+    assert diff.split('\n')[2].split() == [
+        '!', 'amd64', '|', 'foo', '|', '1.0', '|', '1.1']
+
+
+def test_snapshot_identical():
+    session = Session(**{
+        'GET /api/snapshots/a/packages': ['Pamd64 foo 1.0 abc'],
+        'GET /api/snapshots/b/packages': ['Pamd64 foo 1.0 abc'],
+    })
+    aptly = AptlyApi(session=session)
+
+    assert aptly.snapshot_diff('a', 'b') is False
+
+
+def test_switch_components():
+    session = Session()
+    aptly = AptlyApi(session=session)
+
+    aptly.switch_components('buster', 's3:apt:mon', {'main': 'sw1+r2'})
+    assert session.requests[-1] == (
+        'PUT', '/api/publish/s3:apt:mon/buster',
+        {'json': {'Snapshots': [{'Component': 'main', 'Name': 'sw1+r2'}]}})
+
+
+def publication(snapshot):
+    return {'Storage': 's3', 'Prefix': 'apt:mon', 'Distribution': 'buster',
+            'Sources': [{'Component': 'main', 'Name': snapshot}]}
+
+
+def test_publications_updated_after_switch():
+    session = Session(**{
+        'GET /api/publish': [publication('sw1+r1')],
+        'PUT /api/publish/s3:apt:mon/buster': publication('sw1+r2'),
+    })
+    aptly = AptlyApi(session=session)
+
+    assert aptly.publication('s3:apt:mon', 'buster')['Sources'][0]['Name'] \
+        == 'sw1+r1'
+    aptly.switch('buster', 's3:apt:mon', 'sw1+r2')
+    assert aptly.publication('s3:apt:mon', 'buster')['Sources'][0]['Name'] \
+        == 'sw1+r2'
+    assert [method for method, _, _ in session.requests] == ['GET', 'PUT']
+
+
+def test_cli_refreshes_single_publication():
+    session = Session(**{
+        'GET /api/publish': [publication('sw1+r1')],
+        'GET /api/publish/s3:apt:mon/buster': publication('sw1+r2'),
+    })
+    aptly = Aptly(session=session)
+    aptly.execute = lambda *args, **kwargs: None
+
+    aptly.switch('buster', 's3:apt:mon', 'sw1+r2')
+    assert session.requests == []  # nothing loaded yet
+
+    aptly.publication('s3:apt:mon', 'buster')
+    aptly.switch('buster', 's3:apt:mon', 'sw1+r2')
+    assert aptly.publication('s3:apt:mon', 'buster')['Sources'][0]['Name'] \
+        == 'sw1+r2'
+    assert [path for _, path, _ in session.requests] == [
+        '/api/publish', '/api/publish/s3:apt:mon/buster']
+
+
+def test_publications_reloaded_if_refresh_fails():
+    session = Session(**{
+        'GET /api/publish': [publication('sw1+r1')],
+        'GET /api/publish/s3:apt:mon/buster':
+            requests.HTTPError('404 Client Error: Not Found'),
+    })
+    aptly = Aptly(session=session)
+    aptly.execute = lambda *args, **kwargs: None
+
+    aptly.publication('s3:apt:mon', 'buster')
+    aptly.switch('buster', 's3:apt:mon', 'sw1+r2')
+    session.responses['GET /api/publish'] = [publication('sw1+r2')]
+    assert aptly.publication('s3:apt:mon', 'buster')['Sources'][0]['Name'] \
+        == 'sw1+r2'
+    assert [path for _, path, _ in session.requests] == [
+        '/api/publish', '/api/publish/s3:apt:mon/buster', '/api/publish']
+
+
+def test_snapshot_packages_are_cached(tmp_path):
+    session = Session(**{'GET /api/snapshots/sw1+r1/packages': [
+        'Pamd64 foo 1.0 abc', 'Psource foo 1.0 def']})
+    aptly = AptlyApi(session=session, cache=SnapshotCache(str(tmp_path)))
+
+    assert aptly.snapshot_packages('sw1+r1') == [
+        ('foo', '1.0', 'amd64'), ('foo', '1.0', 'source')]
+    aptly.snapshot_packages('sw1+r1')
+    assert len(session.requests) == 1
+
+    aptly.snapshot_drop('sw1+r1')
+    aptly.snapshot_packages('sw1+r1')
+    assert len(session.requests) == 3
+
+
+def test_snapshot_index_follows_changes():
+    aptly = AptlyApi(session=Session())
+
+    assert aptly.snapshot_revisions('sw1') == [1]
+    aptly.snapshot_mirror('sw1+r2', 'sw1')
+    aptly.snapshot_drop('sw1+r1')
+    assert aptly.snapshot_revisions('sw1') == [2]
+    assert aptly.snapshots == ['sw1+r2']
+
+
+def test_diff_planned_merge():
+    session = Session(**{
+        'GET /api/snapshots/a/packages': ['Pamd64 foo 1.0 abc'],
+        'GET /api/snapshots/b/packages': ['Pamd64 foo 1.1 def'],
+        'GET /api/snapshots/m+r1/packages': ['Pamd64 foo 1.0 abc'],
+    })
+    aptly = AptlyApi(session=session)
+
+    assert aptly.plan_merge('m+r2', ['a', 'b'], True)
+    assert aptly.snapshot_diff('m+r1', 'm+r2').split('\n')[1].split() == [
+        '!', 'amd64', '|', 'foo', '|', '1.0', '|', '1.1']
+    assert list(aptly.snapshot_sources('m+r2')) == [
+        ('snapshot', 'a'), ('snapshot', 'b')]
+    assert not any(method == 'POST' for method, _, _ in session.requests)
+
+    aptly.snapshot_merge('m+r2', ['a', 'b'], latest=True)
+    assert session.requests[-1] == (
+        'POST', '/api/snapshots/merge',
+        {'params': {'latest': '1'},
+         'json': {'Destination': 'm+r2', 'Sources': ['a', 'b']}})
+
+
+def test_compare_fingerprints_of_known_snapshots(tmp_path):
+    session = Session(**{
+        'GET /api/snapshots/a/packages': ['Pamd64 foo 1.0 abc'],
+        'GET /api/snapshots/b/packages': ['Pamd64 foo 1.0 abc'],
+    })
+    aptly = AptlyApi(session=session, cache=SnapshotCache(str(tmp_path)))
+    assert aptly.snapshot_diff('a', 'b') is False
+
+    session = Session()
+    aptly = AptlyApi(session=session, cache=SnapshotCache(str(tmp_path)))
+    assert aptly.snapshots_identical('a', 'b')
+    assert aptly.snapshot_diff('a', 'b') is False
+    assert session.requests == []
+
+
+def test_snapshot_metadata_from_list():
+    session = Session()
+    aptly = AptlyApi(session=session)
+
+    assert list(aptly.snapshot_sources('sw1+r1')) == [('mirror', 'sw1')]
+    assert aptly.snapshot_created('sw1+r1') == \
+        datetime.datetime(2019, 3, 6, 10, 0, 0)
+    assert len(session.requests) == 1
+
+    aptly.snapshot_mirror('sw1+r2', 'sw1')
+    assert list(aptly.snapshot_sources('sw1+r2')) == [('mirror', 'sw1')]
+    assert len(session.requests) == 2
@@ -0,0 +1,126 @@
+import os
+import threading
+
+from reptly.cache import SnapshotCache
+
+
+def test_store_package_list(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put('sw1+r1', [('pkg', '1.0-1', 'amd64'), ('lib', '2:1~rc1', 'all')])
+
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get('sw1+r1') == [('lib', '2:1~rc1', 'all'),
+                                   ('pkg', '1.0-1', 'amd64')]
+    assert cache.get('sw1+r2') is None
+
+
+def test_store_empty_package_list(tmp_path):
+    SnapshotCache(str(tmp_path)).put('empty', [])
+
+    assert SnapshotCache(str(tmp_path)).get('empty') == []
+
+
+def test_discard(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put('sw1+r1', [('pkg', '1.0-1', 'amd64')])
+    cache.discard('sw1+r1')
+    cache.discard('sw1+r2')
+
+    assert cache.get('sw1+r1') is None
+    assert SnapshotCache(str(tmp_path)).get('sw1+r1') is None
+
+
+def test_prune_unknown_snapshots(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put('sw1+r1', [])
+    cache.put('a/b c', [])
+    cache.prune(['a/b c', 'other'])
+
+    assert cache.get('sw1+r1') is None
+    assert cache.get('a/b c') == []
+
+
+def test_snapshot_states(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put_state('sw1+r1', 'abc')
+    cache.put_state('sw1+r2', 'def')
+    cache.discard('sw1+r1')
+    cache.flush()
+
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get_state('sw1+r1') is None
+    assert cache.get_state('sw1+r2') == 'def'
+    cache.prune(['sw1+r3'])
+    cache.flush()
+    assert SnapshotCache(str(tmp_path)).get_state('sw1+r2') is None
+
+
+def test_merges(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put_merge('m+r1', ['sw1+r1', 'sw2+r1'], True)
+    cache.put_merge('m+r2', ['sw1+r1', 'sw2+r2'], True)
+    cache.flush()
+
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get_merge('m', ['sw1+r1', 'sw2+r1'], True) == 'm+r1'
+    assert cache.get_merge('m', ['sw1+r1', 'sw2+r1'], False) is None
+    assert cache.get_merge('m', ['sw2+r1', 'sw1+r1'], True) is None
+    # merges of other publications keep their own names
+    assert cache.get_merge('other', ['sw1+r1', 'sw2+r1'], True) is None
+
+    cache.discard('m+r1')
+    assert cache.get_merge('m', ['sw1+r1', 'sw2+r1'], True) is None
+    cache.prune(['sw1+r1'])
+    cache.flush()
+    assert SnapshotCache(str(tmp_path)).get_merge(
+        'm', ['sw1+r1', 'sw2+r2'], True) is None
+
+
+def test_fingerprints(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put('a', [('foo', '1.0', 'amd64'), ('bar', '1', 'all')])
+    cache.put('b', [('bar', '1', 'all'), ('foo', '1.0', 'amd64')])
+    cache.put('c', [('foo', '1.1', 'amd64')])
+    cache.flush()
+
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get_fingerprint('a') == cache.get_fingerprint('b')
+    assert cache.get_fingerprint('a') != cache.get_fingerprint('c')
+    cache.discard('a')
+    assert cache.get_fingerprint('a') is None
+
+
+def test_tables_are_written_on_flush(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    cache.put_state('sw1+r1', 'abc')
+    assert SnapshotCache(str(tmp_path)).get_state('sw1+r1') is None
+
+    cache.flush()
+    assert SnapshotCache(str(tmp_path)).get_state('sw1+r1') == 'abc'
+
+
+def test_concurrent_updates(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    errors = []
+
+    def update(n):
+        try:
+            for i in range(50):
+                cache.put(f'sw{n}+r{i}', [('pkg', str(i), 'amd64')])
+                cache.put_state(f'sw{n}+r{i}', str(i))
+                cache.flush()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=update, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get_state('sw3+r49') == '49'
+    assert cache.get_fingerprint('sw0+r0') is not None
+    assert not [entry for entry in os.listdir(str(tmp_path))
+                if entry.endswith('.tmp')]
@@ -2,6 +2,9 @@ class Namespace():
     def __init__(self, target):
         self.target = target
         self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
 
 
 # mirror
@@ -97,3 +100,93 @@ def test_only_output_of_changes(app, aptly, cronui, capfd):
     assert 'test-distro/main' in out
     assert 'test2-distro' not in out
     assert err == ''
+
+
+def test_reuse_merged_snapshot(app, aptly, cronui, capfd):
+    app.ui = cronui
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[2, 3])
+    aptly.register_snapshot('test-distro+r1')
+    aptly.register_publication('s3:apt:mon', 'distro', main='test-distro+r1')
+    aptly.merges[('test-distro', ('sw1+r1', 'sw2+r3'), True)] = \
+        'test-distro+r1'
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source:
+        - !mirror sw1
+        - !mirror sw2''')
+
+    aptly.schedule('snapshot_sources', 'test-distro+r1', ret=[
+        ('snapshot', 'sw1+r1'),
+        ('snapshot', 'sw2+r3'),
+    ])
+
+    app.exec_publish(Namespace([]))
+    assert aptly.pending_ops == []
+
+    out, err = capfd.readouterr()
+    assert out == ''
+
+
+def test_predict_merge_without_creating_it(app, aptly, cronui, capfd):
+    app.ui = cronui
+    aptly.predictable = True
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[2, 3])
+    aptly.register_snapshot('test-distro+r1')
+    aptly.register_publication('s3:apt:mon', 'distro', main='test-distro+r1')
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source:
+        - !mirror sw1
+        - !mirror sw2''')
+
+    aptly.schedule('snapshot_sources', 'test-distro+r1', ret=[
+        ('snapshot', 'sw1+r1'),
+        ('snapshot', 'sw2+r2'),
+    ])
+    aptly.schedule('snapshot_diff', 'sw2+r2', 'sw2+r3', ret='Updated Snapshot')
+    aptly.schedule('snapshot_diff', 'test-distro+r1', 'test-distro+r2',
+                   ret='Overall Diff')
+
+    app.exec_publish(Namespace([]))
+    assert aptly.pending_ops == []
+
+    out, err = capfd.readouterr()
+    assert 'Overall Diff' in out
+
+
+def test_merges_of_other_publications_are_not_reused(app, aptly, cronui,
+                                                     capfd):
+    app.ui = cronui
+    aptly.predictable = True
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[2, 3])
+    aptly.register_snapshot('test-distro+r1')
+    aptly.register_publication('s3:apt:mon', 'distro', main='test-distro+r1')
+    aptly.merges[('other', ('sw1+r1', 'sw2+r3'), True)] = 'other+r1'
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source:
+        - !mirror sw1
+        - !mirror sw2''')
+
+    aptly.schedule('snapshot_sources', 'test-distro+r1', ret=[
+        ('snapshot', 'sw1+r1'),
+        ('snapshot', 'sw2+r2'),
+    ])
+    aptly.schedule('snapshot_diff', 'sw2+r2', 'sw2+r3', ret='Updated Snapshot')
+    aptly.schedule('snapshot_diff', 'test-distro+r1', 'test-distro+r2',
+                   ret='Overall Diff')
+
+    app.exec_publish(Namespace([]))
+    assert aptly.pending_ops == []
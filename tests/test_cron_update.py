@@ -2,6 +2,9 @@ class Namespace():
     def __init__(self, target):
         self.target = target
         self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
 
 
 def test_no_output_on_no_changes(app, aptly, cronui, capfd):
@@ -0,0 +1,67 @@
+import pytest
+
+from reptly.debversion import compare_versions, version_key
+
+
+# (lower, higher) pairs checked against dpkg --compare-versions
+ORDERED = [
+    ('1.0', '1.1'),
+    ('1.0', '1.0.1'),
+    ('1.0~rc1', '1.0'),
+    ('1.0~rc1', '1.0~rc2'),
+    ('1.0~~', '1.0~'),
+    ('1.0~~a', '1.0~'),
+    ('1.0~~', '1.0~~a'),
+    ('1.0', '1.0a'),
+    ('1.0a', '1.0b'),
+    ('1.0', '1.0+b1'),
+    ('1.0-1', '1.0-2'),
+    ('1.0-1', '1.0.1-1'),
+    ('1.0-1', '1.0+dfsg-1'),
+    ('1.0+dfsg-1', '1.0.1-1'),
+    ('1.2.3-1~bpo10+1', '1.2.3-1'),
+    ('1.2.3-1', '1.2.3-1+deb10u1'),
+    ('2.6.32-5', '2.6.32-41'),
+    ('7.6-0', '7.6p2-4'),
+    ('9.9', '1:0.1'),
+    ('1:1.0', '2:0.1'),
+    ('1.0', '1.0-0.1'),
+    ('A', 'a'),
+    ('a', '+'),
+    ('1+', '1.'),
+    ('0.9', '0.10'),
+    ('1.0-1ubuntu1', '1.0-1ubuntu2'),
+    ('2.30-1', '2.30-1ubuntu0.1'),
+    ('1:2.0-1~', '1:2.0-1'),
+    ('4.19.0-0.bpo.1', '4.19.0-1'),
+    ('1.0.0~alpha', '1.0.0~beta'),
+    ('3.0-rc1-1', '3.0-rc2-1'),
+]
+
+EQUAL = [
+    ('1.0', '1.0'),
+    ('0:1.0', '1.0'),
+    ('1.0-0', '1.0'),
+    ('1.0', '1.00'),
+    ('1.0-1', '1.0-01'),
+]
+
+
+@pytest.mark.parametrize('lower,higher', ORDERED)
+def test_ordered(lower, higher):
+    assert compare_versions(lower, higher) == -1
+    assert compare_versions(higher, lower) == 1
+    assert version_key(lower) < version_key(higher)
+
+
+@pytest.mark.parametrize('a,b', EQUAL)
+def test_equal(a, b):
+    assert compare_versions(a, b) == 0
+    assert version_key(a) == version_key(b)
+
+
+def test_sort():
+    versions = ['1.0', '1.0~rc1', '1:0.5', '1.0-1', '0.9+git20190101', '1.0+b1']
+
+    assert sorted(versions, key=version_key) == [
+        '0.9+git20190101', '1.0~rc1', '1.0', '1.0-1', '1.0+b1', '1:0.5']
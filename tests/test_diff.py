@@ -0,0 +1,61 @@
+from reptly.diff import diff_packages, format_diff, merge_packages
+
+
+def test_identical():
+    packages = [('foo', '1.0', 'amd64'), ('bar', '2', 'all')]
+
+    assert diff_packages(packages, list(reversed(packages))) == []
+
+
+def test_added_removed_updated():
+    old = [('foo', '1.0', 'amd64'), ('foo', '1.0', 'i386'), ('old', '1', 'all')]
+    new = [('foo', '1.1', 'amd64'), ('foo', '1.0', 'i386'), ('new', '3', 'all')]
+
+    assert diff_packages(old, new) == [
+        ('+', 'all', 'new', '-', '3'),
+        ('-', 'all', 'old', '1', '-'),
+        ('!', 'amd64', 'foo', '1.0', '1.1'),
+    ]
+
+
+def test_multiple_versions():
+    old = [('foo', '1.0', 'amd64'), ('foo', '1.1', 'amd64')]
+    new = [('foo', '1.1', 'amd64'), ('foo', '1.2', 'amd64'), ('foo', '1.3', 'amd64')]
+
+    assert diff_packages(old, new) == [
+        ('-', 'amd64', 'foo', '1.0', '-'),
+        ('+', 'amd64', 'foo', '-', '1.2'),
+        ('+', 'amd64', 'foo', '-', '1.3'),
+    ]
+
+
+def test_format():
+    diff = format_diff([('!', 'amd64', 'foo', '1.0', '1.1')]).split('\n')
+
+    assert diff[0].split() == ['Arch', '|', 'Package', '|', 'Version', 'in',
+                               'A', '|', 'Version', 'in', 'B']
+    assert diff[1].startswith('! amd64  | foo ')
+    assert diff[2] == ''
+
+
+def test_merge_override():
+    first = [('foo', '1.0', 'amd64'), ('foo', '1.1', 'amd64'), ('bar', '1', 'all')]
+    second = [('foo', '0.9', 'amd64'), ('foo', '2.0', 'i386')]
+
+    assert merge_packages([first, second]) == [
+        ('bar', '1', 'all'),
+        ('foo', '0.9', 'amd64'),
+        ('foo', '2.0', 'i386'),
+    ]
+
+
+def test_merge_latest():
+    first = [('foo', '1.0', 'amd64'), ('foo', '1.1~rc1', 'amd64'), ('bar', '1', 'all')]
+    second = [('foo', '1.0-1', 'amd64'), ('foo', '2.0', 'i386')]
+    third = [('bar', '1:0.1', 'all')]
+
+    assert merge_packages([first, second, third], latest=True) == [
+        ('bar', '1:0.1', 'all'),
+        ('foo', '1.1~rc1', 'amd64'),
+        ('foo', '2.0', 'i386'),
+    ]
@@ -0,0 +1,130 @@
+import datetime
+
+
+class Namespace():
+    def __init__(self, target, dry_run=False):
+        self.target = target
+        self.dry_run = dry_run
+        self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
+
+
+def test_keep_newest_revisions(app, aptly, capfd):
+    aptly.register_mirror('sw1', snapshots=[1, 2, 3, 4])
+    aptly.register_repo('pkgs', snapshots=[1, 2])
+    app.load('''gc:
+  keep: 2
+  min-age: 0
+  sources:
+    pkgs:
+      keep: 1
+publish:
+  - alias: 'test-distro'
+    destination: s3:apt:mon
+    distribution: distro
+    components:
+      main: !mirror sw1
+      extra: !repo pkgs''')
+
+    aptly.schedule('snapshot_drop_batch', 'sw1+r2', 'sw1+r1', 'pkgs+r1')
+    aptly.schedule('db_cleanup')
+
+    app.exec_gc(Namespace([]))
+    assert aptly.pending_ops == []
+
+    out, err = capfd.readouterr()
+    assert 'Dropping sw1+r1' in out
+
+
+def test_dry_run(app, aptly, capfd):
+    aptly.register_mirror('sw1', snapshots=[1, 2])
+    app.load('''gc:
+  keep: 1
+  min-age: 0
+publish:
+  - alias: 'test-distro'
+    destination: s3:apt:mon
+    distribution: distro
+    source: !mirror sw1''')
+
+    app.exec_gc(Namespace([], dry_run=True))
+    assert aptly.pending_ops == []
+
+    out, err = capfd.readouterr()
+    assert out == 'Would drop sw1+r1\n'
+
+
+def test_keep_young_snapshots(app, aptly):
+    aptly.register_mirror('sw1', snapshots=[1, 2, 3])
+    aptly.created['sw1+r2'] = datetime.datetime.now()
+    app.load('''gc:
+  keep: 1
+  min-age: 7
+publish:
+  - alias: 'test-distro'
+    destination: s3:apt:mon
+    distribution: distro
+    source: !mirror sw1''')
+
+    aptly.schedule('snapshot_drop_batch', 'sw1+r1')
+    aptly.schedule('db_cleanup')
+
+    app.exec_gc(Namespace([]))
+    assert aptly.pending_ops == []
+
+
+def test_keep_published_and_merged_snapshots(app, aptly):
+    aptly.register_mirror('sw1', snapshots=[1, 2, 3])
+    aptly.register_mirror('sw2', snapshots=[1, 2, 3])
+    aptly.register_snapshot('test-distro+r1')
+    aptly.register_snapshot('test-distro+r2')
+    aptly.register_snapshot('test-distro+r3')
+    aptly.register_publication('s3:apt:mon', 'distro', main='test-distro+r2')
+    app.load('''gc:
+  keep: 1
+  min-age: 0
+publish:
+  - alias: 'test-distro'
+    destination: s3:apt:mon
+    distribution: distro
+    source:
+      - !mirror sw1
+      - !mirror sw2''')
+
+    aptly.schedule('snapshot_sources', 'test-distro+r3', ret=[
+        ('snapshot', 'sw1+r3'),
+        ('snapshot', 'sw2+r3'),
+    ])
+    aptly.schedule('snapshot_sources', 'test-distro+r2', ret=[
+        ('snapshot', 'sw1+r1'),
+        ('snapshot', 'sw2+r3'),
+    ])
+    aptly.schedule('snapshot_drop_batch', 'test-distro+r1', 'sw1+r2',
+                   'sw2+r2', 'sw2+r1')
+    aptly.schedule('db_cleanup')
+
+    app.exec_gc(Namespace([]))
+    assert aptly.pending_ops == []
+
+
+def test_only_selected_sources(app, aptly):
+    aptly.register_mirror('sw1', snapshots=[1, 2])
+    aptly.register_mirror('sw2', snapshots=[1, 2])
+    app.load('''gc:
+  keep: 1
+  min-age: 0
+publish:
+  - alias: 'test-distro'
+    destination: s3:apt:mon
+    distribution: distro
+    components:
+      main: !mirror sw1
+      extra: !mirror sw2''')
+
+    aptly.schedule('snapshot_drop_batch', 'sw2+r1')
+    aptly.schedule('db_cleanup')
+
+    app.exec_gc(Namespace(['sw2']))
+    assert aptly.pending_ops == []
@@ -0,0 +1,146 @@
+import subprocess
+
+import pytest
+
+from reptly import trace
+from reptly.diff import format_diff
+from reptly.history import History, percentile
+
+
+class Namespace():
+    def __init__(self, target):
+        self.target = target
+        self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
+
+
+@pytest.fixture
+def tracer():
+    tracer = trace.enable()
+    yield tracer
+    trace.disable()
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = History(str(tmp_path / 'state' / 'history.sqlite'))
+    yield history
+    history.close()
+
+
+def add_updates(history, source, durations, *, status='unchanged',
+                start=0):
+    with history.connection as db:
+        for i, duration in enumerate(durations):
+            run = db.execute(
+                'INSERT INTO runs (started, duration, action, success) '
+                'VALUES (?, ?, ?, ?)',
+                (start + i * 3600, duration, 'update', 1)).lastrowid
+            db.execute(
+                'INSERT INTO updates (run, source, duration, status) '
+                'VALUES (?, ?, ?, ?)', (run, source, duration, status))
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3], 90) == 3
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4, 5], 90) == pytest.approx(4.6)
+    assert percentile([1, 2, 3, 4, 5], 100) == 5
+
+
+def test_record_update_and_switch(app, aptly, history, tracer):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_publication('s3:apt:mon', 'distro', main='sw1+r1')
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source: !mirror sw1''')
+    aptly.changes = [('created', 'sw1+r2'), ('dropped', 'sw1+r1')]
+
+    diff = format_diff([('!', 'amd64', 'foo', '1.0', '1.1'),
+                        ('+', 'amd64', 'bar', '-', '2.0')])
+    aptly.schedule('mirror_update', 'sw1', True, ret=4096)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=diff)
+    app.exec_update(Namespace(['sw1']))
+    with pytest.raises(subprocess.CalledProcessError):
+        with trace.phase('update', 'sw2'):
+            raise subprocess.CalledProcessError(1, ['aptly'])
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=diff)
+    aptly.schedule('switch', 'distro', 's3:apt:mon', 'sw1+r2')
+    aptly.schedule('snapshot_drop', 'sw1+r1', False)
+    app.exec_publish(Namespace([]))
+
+    run = history.record(app, tracer, action='run', started=1000.0,
+                         duration=3.5, success=False)
+    db = history.connection
+    assert db.execute('SELECT * FROM runs').fetchall() == \
+        [(run, 1000.0, 3.5, 'run', 0)]
+    assert db.execute('SELECT source, status, changed_packages, '
+                      'downloaded_bytes FROM updates').fetchall() == [
+        ('sw1', 'changed', 2, 4096),
+        ('sw2', 'failed', None, None),
+    ]
+    assert db.execute('SELECT action, name FROM snapshots').fetchall() == \
+        [('created', 'sw1+r2'), ('dropped', 'sw1+r1')]
+    assert db.execute('SELECT publication, component, old, new, '
+                      'changed_packages FROM switches').fetchall() == \
+        [('test-distro', 'main', 'sw1+r1', 'sw1+r2', 2)]
+    assert db.execute('SELECT duration FROM switches').fetchone()[0] >= 0
+
+
+def test_analyze(history):
+    add_updates(history, 'big', [10, 11, 9, 10, 12, 10, 30, 31, 29, 32, 30])
+    add_updates(history, 'small', [1, 1, 2, 1, 1, 1, 1, 1, 2, 1],
+                status='changed',
+                start=86400)
+    add_updates(history, 'new', [5, 6])
+
+    stats = {s['source']: s for s in history.analyze()}
+    assert stats['big']['updates'] == 11
+    assert stats['big']['p50'] == 12
+    assert stats['big']['max'] == 32
+    assert stats['big']['last'] == 30
+    assert stats['big']['changed'] == 0
+    assert stats['big']['baseline'] == 10
+    assert stats['big']['regressed'] is True
+    assert stats['small']['regressed'] is False
+    assert stats['small']['changed'] == 1
+    assert stats['small']['per_day'] == 10
+    assert stats['new']['regressed'] is None
+
+    assert [s['source'] for s in history.analyze(['s*'])] == ['small']
+    assert [s['source'] for s in history.analyze(since=86400)] == \
+        ['small']
+
+
+def test_expected_durations(history):
+    add_updates(history, 'big', [100, 10, 11, 9, 10, 12])
+    add_updates(history, 'small', [1, 3])
+    add_updates(history, 'small', [60], status='failed')
+
+    assert history.expected_durations() == {'big': 10, 'small': 2}
+    assert history.expected_durations(recent=1) == {'big': 12, 'small': 3}
+
+
+def test_report(history):
+    assert history.report() == 'No updates recorded\n'
+    add_updates(history, 'big', [10, 11, 9, 10, 12, 10, 30, 31, 29, 32, 30])
+    add_updates(history, 'small', [1, 1, 2, 1, 1, 1, 1, 1, 2, 1],
+                status='changed')
+
+    lines = history.report().split('\n')
+    assert lines[0].split() == ['source', 'updates', 'failed', 'p50', 'p90',
+                                'max', 'last', 'changed', 'per', 'day']
+    assert lines[1].split() == ['big', '11', '0', '12.0', '31.0', '32.0',
+                                '30.0', '0%', '0.00', 'REGRESSED',
+                                '(baseline', 'p50', '10.0)']
+    assert lines[2].split()[:8] == ['small', '10', '0', '1.0', '2.0', '2.0',
+                                    '1.0', '100%']
+    assert lines[4].startswith('21 runs since ')
@@ -0,0 +1,149 @@
+import datetime
+import fcntl
+import os
+
+import pytest
+
+plyvel = pytest.importorskip('plyvel')
+msgpack = pytest.importorskip('msgpack')
+
+from reptly.aptly import Aptly  # noqa: E402
+from reptly.leveldb import AptlyDatabase, AptlyDb, decode_time  # noqa: E402
+
+
+CREATED = datetime.datetime(2019, 3, 6, 10, 0, 0)
+
+
+def binc_time(value: datetime.datetime):
+    ''' Encode a time like the msgpack codec of aptly (secs, nsecs) '''
+    secs = int(value.timestamp()).to_bytes(8, 'big', signed=True)
+    nsecs = (500000).to_bytes(3, 'big')
+    return bytes([0x80 | 0x40 | (7 << 2) | 2]) + secs + nsecs
+
+
+def put(db, key, **record):
+    # aptly's encoder stores strings and bytes alike as raw strings
+    db.put(key.encode(), msgpack.packb(record, use_bin_type=False))
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'db')
+    db = plyvel.DB(path, create_if_missing=True)
+    put(db, 'Rm1', UUID='m1', Name='sw1',
+        ArchiveRoot='http://deb.debian.org/debian/')
+    put(db, 'Ll1', UUID='l1', Name='pkgs')
+    put(db, 'Ss1', UUID='s1', Name='sw1+r1', CreatedAt=binc_time(CREATED),
+        SourceKind='repo', SourceIDs=['m1'],
+        Description='Snapshot from mirror [sw1]: http://deb.debian.org/')
+    put(db, 'Ss2', UUID='s2', Name='pkgs+r1', CreatedAt=binc_time(CREATED),
+        SourceKind='local', SourceIDs=['l1'], Description='')
+    put(db, 'Ss3', UUID='s3', Name='m+r1', CreatedAt=binc_time(CREATED),
+        SourceKind='snapshot', SourceIDs=['s1', 's2'],
+        Description="Merged from sources: 'sw1+r1', 'pkgs+r1'")
+    put(db, 'Es1', Refs=[b'Pamd64 foo 1.0 abc', b'Psource foo 1.0 def'])
+    put(db, 'Us3:apt:mon>>buster', UUID='p1', Storage='s3:apt',
+        Prefix='mon', Distribution='buster', SourceKind='snapshot',
+        Sources={'main': 's3'})
+    db.close()
+    return AptlyDatabase(path)
+
+
+def test_decode_time():
+    assert decode_time(binc_time(CREATED)) == \
+        CREATED + datetime.timedelta(microseconds=500)
+    assert decode_time('2019-03-06 10:00:00 CET') == CREATED
+
+
+def test_list_names(database):
+    assert database.names('mirror') == ['sw1']
+    assert database.names('repo') == ['pkgs']
+    assert database.names('snapshot') == ['m+r1', 'pkgs+r1', 'sw1+r1']
+
+
+def test_snapshot_meta(database):
+    metas = {meta.name: meta for meta in database.snapshot_meta()}
+
+    assert metas['m+r1'].sources == (('snapshot', 'sw1+r1'),
+                                     ('snapshot', 'pkgs+r1'))
+    assert metas['sw1+r1'].sources == (('mirror', 'sw1'),)
+    assert metas['pkgs+r1'].sources == (('repo', 'pkgs'),)
+    assert metas['sw1+r1'].created.replace(microsecond=0) == CREATED
+    assert [meta.name for meta in database.snapshot_meta(['m+r1'])] == \
+        ['m+r1']
+
+
+def test_snapshot_packages(database):
+    assert database.snapshot_packages('sw1+r1') == [
+        ('foo', '1.0', 'amd64'), ('foo', '1.0', 'source')]
+    assert database.snapshot_packages('m+r1') == []
+
+
+def test_publications(database):
+    expected = {
+        'Storage': 's3:apt', 'Prefix': 'mon', 'Distribution': 'buster',
+        'SourceKind': 'snapshot',
+        'Sources': [{'Component': 'main', 'Name': 'm+r1'}],
+    }
+    assert database.publications() == [expected]
+    assert database.publication('s3:apt:mon', 'buster') == expected
+    assert database.publication('s3:apt:mon', 'stretch') is None
+
+
+def test_backend_reads_from_database(database):
+    aptly = AptlyDb(db=database)
+    aptly.execute = None  # no aptly calls expected
+
+    assert aptly.snapshots == ['m+r1', 'pkgs+r1', 'sw1+r1']
+    assert list(aptly.snapshot_sources('m+r1')) == [
+        ('snapshot', 'sw1+r1'), ('snapshot', 'pkgs+r1')]
+    assert aptly.publication('s3:apt:mon', 'buster')['Sources'] == [
+        {'Component': 'main', 'Name': 'm+r1'}]
+    assert aptly.snapshot_packages('sw1+r1')[0] == ('foo', '1.0', 'amd64')
+
+
+def test_backend_falls_back_while_locked(database, monkeypatch):
+    calls = []
+    monkeypatch.setattr(Aptly, 'get_raw_list',
+                        lambda self, type: calls.append(type) or ['x'])
+    aptly = AptlyDb(db=database)
+    with open(os.path.join(database.path, 'LOCK'), 'rb') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # like a running aptly
+        assert aptly.mirrors == ['x']
+    assert calls == ['mirror']
+
+
+def files(path):
+    return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+            for entry in os.scandir(path)}
+
+
+def test_database_files_are_not_modified(database):
+    before = files(database.path)
+
+    assert database.names('mirror') == ['sw1']
+    database.close()
+    assert files(database.path) == before
+
+
+def test_checkpoint_reused_until_database_changes(database, monkeypatch):
+    DB = plyvel.DB
+    opened = []
+
+    def open_db(path, **kwargs):
+        opened.append(path)
+        return DB(path, **kwargs)
+    monkeypatch.setattr(plyvel, 'DB', open_db)
+
+    assert database.names('repo') == ['pkgs']
+    assert database.names('mirror') == ['sw1']
+    assert len(opened) == 1
+    assert opened[0] != database.path
+
+    db = DB(database.path)  # aptly adds a repo
+    put(db, 'Ll2', UUID='l2', Name='pkgs2')
+    db.close()
+    assert database.names('repo') == ['pkgs', 'pkgs2']
+    assert len(opened) == 2
+    database.close()
+    assert not os.path.exists(opened[1])
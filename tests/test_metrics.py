@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from reptly import trace
+from reptly.aptly import parse_download_size
+from reptly.diff import format_diff
+from reptly.domain import Diff, SnapshotContentMixin
+from reptly.metrics import Metrics, changed_packages
+
+
+Snapshot = SnapshotContentMixin.Snapshot
+
+
+class Namespace():
+    def __init__(self, target):
+        self.target = target
+        self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
+
+
+@pytest.fixture
+def tracer():
+    tracer = trace.enable()
+    yield tracer
+    trace.disable()
+
+
+def test_parse_download_size():
+    assert parse_download_size(
+        'Downloading & parsing package files...\n'
+        'Building download queue...\n'
+        'Download queue: 25 items (31.50 MiB)\n') == 31.5 * 1024 * 1024
+    assert parse_download_size('Download queue: 1 items (912 B)\n') == 912
+    assert parse_download_size('Download queue: 0 items (0 B)\n') == 0
+    assert parse_download_size('') == 0
+
+
+def test_changed_packages():
+    diff = format_diff([('+', 'amd64', 'foo', '-', '1.0'),
+                        ('!', 'amd64', 'bar', '1.0', '1.1')])
+    assert changed_packages(Diff(diff, Snapshot('a+r1', 1),
+                                 Snapshot('a+r2', 2))) == 2
+    assert changed_packages(Diff('Name: a+r1\nNumber of packages: 12\n',
+                                 Snapshot(None, 0),
+                                 Snapshot('a+r1', 1))) == 12
+    assert changed_packages(False) == 0
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.set('reptly_run_success', 1, 'Whether the run succeeded')
+    metrics.add('reptly_aptly_calls', 1, 'aptly calls',
+                operation='aptly snapshot "x"')
+    metrics.add('reptly_aptly_calls', 1, 'aptly calls',
+                operation='aptly snapshot "x"')
+
+    assert metrics.render() == (
+        '# HELP reptly_run_success Whether the run succeeded\n'
+        '# TYPE reptly_run_success gauge\n'
+        'reptly_run_success 1\n'
+        '# HELP reptly_aptly_calls aptly calls\n'
+        '# TYPE reptly_aptly_calls gauge\n'
+        'reptly_aptly_calls{operation="aptly snapshot \\"x\\""} 2\n')
+
+
+def test_write_atomically(tmp_path):
+    path = str(tmp_path / 'reptly.prom')
+    metrics = Metrics()
+    metrics.collect_run(12.5, True)
+    metrics.write(path)
+
+    with open(path) as f:
+        content = f.read()
+    assert 'reptly_run_duration_seconds 12.5\n' in content
+    assert 'reptly_run_success 1\n' in content
+    assert os.listdir(str(tmp_path)) == ['reptly.prom']
+
+
+def test_collect_update_run(app, aptly, tracer):
+    aptly.register_mirror('sw1', snapshots=[1])
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source: !mirror sw1''')
+
+    aptly.schedule('mirror_update', 'sw1', True, ret=2048)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=format_diff(
+        [('!', 'amd64', 'foo', '1.0', '1.1')]))
+    app.exec_update(Namespace([]))
+    with trace.span('command', 'aptly mirror update'):
+        pass
+    with trace.span('http', 'GET /api/snapshots/sw1+r1/packages'):
+        pass
+
+    metrics = Metrics()
+    metrics.collect_app(app)
+    metrics.collect_trace(tracer)
+    content = metrics.render()
+    assert 'reptly_source_changed_packages{source="sw1"} 1\n' in content
+    assert 'reptly_source_downloaded_bytes{source="sw1"} 2048\n' in content
+    assert 'reptly_source_snapshots{source="sw1"} 2\n' in content
+    assert 'reptly_source_update_duration_seconds{source="sw1"} ' in content
+    assert 'reptly_aptly_calls{operation="aptly mirror update"} 1\n' \
+        in content
+    assert 'reptly_aptly_calls{operation="GET /api/snapshots"} 1\n' \
+        in content
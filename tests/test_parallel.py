@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from reptly.parallel import DeferredOutput, Graph, HostLimiter, \
+    run_parallel
+
+
+def build(log, fail=None):
+    lock = threading.Lock()
+
+    def task(name):
+        def run():
+            if name == fail:
+                raise RuntimeError(name)
+            with lock:
+                log.append(name)
+        return run
+
+    graph = Graph()
+    graph.add('a', task('a'))
+    graph.add('b', task('b'))
+    graph.add('join', None, ['a', 'b'])
+    graph.add('c', task('c'), ['join'])
+    graph.add('d', task('d'), ['b', 'unknown'])
+    return graph
+
+
+def test_run_in_order():
+    log = []
+    build(log).run(1)
+
+    assert log == ['a', 'b', 'c', 'd']
+
+
+@pytest.mark.parametrize('jobs', [2, 4])
+def test_run_after_dependencies(jobs):
+    log = []
+    build(log).run(jobs)
+
+    assert sorted(log) == ['a', 'b', 'c', 'd']
+    assert log.index('c') > log.index('a')
+    assert log.index('c') > log.index('b')
+    assert log.index('d') > log.index('b')
+
+
+def test_skip_dependents_of_failed_tasks():
+    log = []
+    with pytest.raises(RuntimeError):
+        build(log, fail='b').run(2)
+
+    assert log == ['a']
+
+
+def test_host_limiter():
+    limit = HostLimiter(2)
+    running = {'a': 0, 'b': 0}
+    peak = {'a': 0, 'b': 0}
+    lock = threading.Lock()
+
+    def work(host):
+        with limit(host):
+            with lock:
+                running[host] += 1
+                peak[host] = max(peak[host], running[host])
+            time.sleep(0.01)
+            with lock:
+                running[host] -= 1
+
+    list(run_parallel(work, ['a'] * 6 + ['b'] * 3, 8))
+    assert peak == {'a': 2, 'b': 2}
+
+
+def test_output_deferred_while_dialog_is_open(capsys):
+    output = DeferredOutput()
+    opened = threading.Event()
+    answered = threading.Event()
+
+    def dialog():
+        with output.dialog():
+            print('question?')
+            opened.set()
+            answered.wait()
+
+    thread = threading.Thread(target=dialog)
+    thread.start()
+    opened.wait()
+    output.write('update done')  # does not block
+    assert capsys.readouterr().out == 'question?\n'
+    answered.set()
+    thread.join()
+    assert capsys.readouterr().out == 'update done\n'
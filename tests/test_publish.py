@@ -5,6 +5,9 @@ class Namespace():
     def __init__(self, target):
         self.target = target
         self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
 
 
 # single
@@ -485,3 +488,33 @@ def test_publish_components_update_one(app, aptly):
 
     app.exec_publish(Namespace(['test-distro']))
     assert aptly.pending_ops == []
+
+
+def test_publish_merge_create_predicted_merge_on_switch(app, aptly):
+    aptly.predictable = True
+    aptly.register_mirror('software1', snapshots=[1])
+    aptly.register_mirror('software2', snapshots=[1, 2])
+    aptly.register_snapshot('test-distro+r1')
+    aptly.register_publication('s3:apt:mon', 'distro', main='test-distro+r1')
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source:
+          - !mirror software1
+          - !mirror software2''')
+
+    aptly.schedule('snapshot_sources', 'test-distro+r1', ret=[
+        ('snapshot', 'software1+r1'),
+        ('snapshot', 'software2+r1'),
+    ])
+    aptly.schedule('snapshot_diff', 'software2+r1', 'software2+r2', ret='D!')
+    aptly.schedule('snapshot_diff', 'test-distro+r1', 'test-distro+r2', ret='D!')
+    aptly.schedule('snapshot_merge', 'test-distro+r2', True,
+                   'software1+r1', 'software2+r2')
+    aptly.schedule('switch', 'distro', 's3:apt:mon', 'test-distro+r2')
+    aptly.schedule('snapshot_drop', 'test-distro+r1', False)
+
+    app.exec_publish(Namespace(['test-distro']))
+    assert aptly.pending_ops == []
@@ -1,7 +1,15 @@
+import subprocess
+
+import pytest
+
+
 class Namespace():
     def __init__(self, target):
         self.target = target
         self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
 
 
 # mirror
@@ -59,3 +67,186 @@ def test_update_all_referenced_mirrors_and_publish_initially(app, aptly):
 
     app.exec_run(Namespace(['publish-name']))
     assert aptly.pending_ops == []
+
+
+def test_update_shared_sources_once(app, aptly):
+    aptly.register_mirror('libc', snapshots=[1])
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_snapshot('one+r1')
+    aptly.register_snapshot('two+r1')
+    aptly.register_publication('s3:apt:one', 'distro', main='one+r1')
+    aptly.register_publication('s3:apt:two', 'distro', main='two+r1')
+    app.load('''publish:
+      - alias: 'one'
+        destination: s3:apt:one
+        distribution: distro
+        source:
+          - !mirror libc
+          - !mirror sw1
+      - alias: 'two'
+        destination: s3:apt:two
+        distribution: distro
+        source:
+          - !mirror libc
+          - !mirror sw2''')
+
+    aptly.schedule('mirror_update', 'libc', True)
+    aptly.schedule('snapshot_mirror', 'libc+r2', 'libc')
+    aptly.schedule('snapshot_diff', 'libc+r1', 'libc+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'libc+r2', True)
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw1+r2', True)
+    aptly.schedule('snapshot_sources', 'one+r1', ret=[
+        ('snapshot', 'libc+r1'),
+        ('snapshot', 'sw1+r1'),
+    ])
+    aptly.schedule('snapshot_merge', 'one+r2', True, 'libc+r1', 'sw1+r1')
+    aptly.schedule('snapshot_diff', 'one+r1', 'one+r2', ret='Diff!')
+    aptly.schedule('switch', 'distro', 's3:apt:one', 'one+r2')
+    aptly.schedule('snapshot_drop', 'one+r1', False)
+
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw2+r2', True)
+    aptly.schedule('snapshot_sources', 'two+r1', ret=[
+        ('snapshot', 'libc+r1'),
+        ('snapshot', 'sw2+r1'),
+    ])
+    aptly.schedule('snapshot_merge', 'two+r2', True, 'libc+r1', 'sw2+r1')
+    aptly.schedule('snapshot_diff', 'two+r1', 'two+r2', ret='Diff!')
+    aptly.schedule('switch', 'distro', 's3:apt:two', 'two+r2')
+    aptly.schedule('snapshot_drop', 'two+r1', False)
+
+    app.exec_run(Namespace(['*']))
+    assert aptly.pending_ops == []
+
+
+def test_run_publications_in_parallel(app, aptly, capfd):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_publication('s3:apt:one', 'distro', main='sw1+r1')
+    aptly.register_publication('s3:apt:two', 'distro', main='sw2+r1')
+    aptly.unordered = True
+    app.load('''publish:
+      - alias: 'one'
+        destination: s3:apt:one
+        distribution: distro
+        source: !mirror sw1
+      - alias: 'two'
+        destination: s3:apt:two
+        distribution: distro
+        source: !mirror sw2''')
+
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret='Diff sw1!')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret='Diff sw1!')
+    aptly.schedule('switch', 'distro', 's3:apt:one', 'sw1+r2')
+    aptly.schedule('snapshot_drop', 'sw1+r1', False)
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw2+r2', True)
+
+    args = Namespace(['*'])
+    args.jobs = 2
+    app.exec_run(args)
+    assert aptly.pending_ops == []
+
+    out, err = capfd.readouterr()
+    assert 'Diff sw1!' in out
+
+
+def test_publish_after_last_source_in_update_order(app, aptly):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_publication('s3:apt:one', 'distro', main='sw1+r1')
+    aptly.register_publication('s3:apt:two', 'distro', main='sw2+r1')
+    app.load('''publish:
+      - alias: 'one'
+        destination: s3:apt:one
+        distribution: distro
+        source: !mirror sw1
+      - alias: 'two'
+        destination: s3:apt:two
+        distribution: distro
+        source: !mirror sw2''')
+    app.expected = {'sw1': 60.0, 'sw2': 5.0}
+
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret='Diff sw2!')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret='Diff sw2!')
+    aptly.schedule('switch', 'distro', 's3:apt:two', 'sw2+r2')
+    aptly.schedule('snapshot_drop', 'sw2+r1', False)
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw1+r2', True)
+
+    args = Namespace(['*'])
+    args.order = 'shortest'
+    app.exec_run(args)
+    assert aptly.pending_ops == []
+
+
+def test_sequential_run_does_not_resolve_hosts(app, aptly):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_publication('s3:apt:one', 'distro', main='sw1+r1')
+    app.load('''publish:
+      - alias: 'one'
+        destination: s3:apt:one
+        distribution: distro
+        source: !mirror sw1''')
+
+    def mirror_url(name):
+        raise AssertionError('mirror show for ' + name)
+    aptly.mirror_url = mirror_url
+
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw1+r2', True)
+
+    app.exec_run(Namespace(['one']))
+    assert aptly.pending_ops == []
+
+
+def test_parallel_run_reports_failed_updates(app, aptly, capsys):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_publication('s3:apt:one', 'distro', main='sw1+r1')
+    aptly.register_publication('s3:apt:two', 'distro', main='sw2+r1')
+    aptly.unordered = True
+    app.load('''publish:
+      - alias: 'one'
+        destination: s3:apt:one
+        distribution: distro
+        source: !mirror sw1
+      - alias: 'two'
+        destination: s3:apt:two
+        distribution: distro
+        source: !mirror sw2''')
+    mirror_update = aptly.mirror_update
+
+    def failing_update(name, *, quiet=False):
+        if name == 'sw1':
+            raise subprocess.CalledProcessError(1, ['aptly'], stderr=b'404')
+        return mirror_update(name, quiet=quiet)
+    aptly.mirror_update = failing_update
+
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw2+r2', True)
+
+    args = Namespace(['*'])
+    args.jobs = 2
+    with pytest.raises(subprocess.CalledProcessError):
+        app.exec_run(args)
+    assert aptly.pending_ops == []
+    assert 'sw1\n---\nUpdate failed: ' in capsys.readouterr().out
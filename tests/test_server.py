@@ -0,0 +1,107 @@
+import os
+import socketserver
+import stat
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from reptly.aptly import Aptly
+from reptly.server import ApiServer, UnixAdapter
+
+
+FAKE_APTLY = '''#!{python}
+import json
+import socketserver
+import sys
+from http.server import BaseHTTPRequestHandler
+
+listen = [arg for arg in sys.argv if arg.startswith('-listen=')]
+if sys.argv[1:3] != ['api', 'serve'] or '-no-lock' not in sys.argv \\
+        or 'fail' in listen[0]:
+    print('unexpected arguments', sys.argv[1:])
+    sys.exit(2)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({{'path': self.path}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return 'unix'
+
+
+server = socketserver.UnixStreamServer(listen[0][len('-listen=unix://'):],
+                                       Handler)
+server.serve_forever()
+'''
+
+
+@pytest.fixture
+def fake_aptly(tmp_path, monkeypatch):
+    path = tmp_path / 'aptly'
+    path.write_text(FAKE_APTLY.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{tmp_path}:{os.environ["PATH"]}')
+
+
+def test_serve_on_unix_socket(fake_aptly):
+    with ApiServer() as server:
+        socket_path = server.socket_path
+        process = server.process
+        aptly = Aptly(server.url, session=server.session)
+        assert aptly.request('GET', 'publish') == {'path': '/api/publish'}
+        assert aptly.request('GET', 'version') == {'path': '/api/version'}
+    assert process.poll() is not None
+    assert not os.path.exists(socket_path)
+
+
+def test_report_failing_server(fake_aptly, monkeypatch):
+    monkeypatch.setattr(ApiServer, 'socket_path', 'fail')
+    with pytest.raises(RuntimeError, match='unexpected arguments'):
+        ApiServer().start()
+
+
+def test_connections_are_reused(tmp_path):
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            connections.append(self.request)
+            super().setup()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'[]')
+
+        def log_message(self, *args):
+            pass
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    path = str(tmp_path / 'api.sock')
+    server = Server(path, Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        session = requests.Session()
+        session.mount('http://aptly/', UnixAdapter(path))
+        aptly = Aptly('http://aptly', session=session)
+        for _ in range(3):
+            assert aptly.request('GET', 'publish') == []
+        assert len(connections) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
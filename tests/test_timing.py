@@ -0,0 +1,47 @@
+import pytest
+
+from reptly import timing, trace
+
+
+@pytest.fixture
+def timer():
+    timer = timing.enable()
+    yield timer
+    timing.disable()
+
+
+def test_time_outermost_phases(timer):
+    for _ in range(2):
+        with trace.phase('publish', 'test-distro'):
+            with trace.phase('diff'):
+                sum(range(10000))
+    with trace.phase('update', 'sw1'):
+        pass
+
+    assert list(timer.phases) == ['publish', 'update']
+    calls, wall, cpu = timer.phases['publish']
+    assert calls == 2
+    assert wall > 0 and cpu >= 0
+
+
+def test_report(timer):
+    timer.add('load', 0.5, 0.25)
+    timer.add('link', 1.0, 0.5)
+
+    lines = timer.report().splitlines()
+    assert lines[0].split() == ['phase', 'calls', 'wall', '[s]', 'cpu', '[s]']
+    assert lines[1].split() == ['load', '1', '0.500', '0.250']
+    assert lines[2].split() == ['link', '1', '1.000', '0.500']
+    assert lines[3].split()[0] == 'total'
+
+
+def test_load_and_link_phases(app, aptly, timer):
+    aptly.register_mirror('test')
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source: !mirror test''')
+
+    assert list(timer.phases) == ['load', 'link']
@@ -0,0 +1,74 @@
+import json
+import subprocess
+
+import pytest
+
+from reptly import trace
+from reptly.aptly import Aptly
+
+
+@pytest.fixture
+def tracer():
+    tracer = trace.enable()
+    yield tracer
+    trace.disable()
+
+
+def test_disabled_tracing_records_nothing():
+    assert trace.tracer is None
+    with trace.span('command', 'aptly snapshot list') as record:
+        record.status = 0
+
+
+def test_record_phase_and_alias(tracer):
+    with trace.phase('publish', 'test-distro'):
+        with trace.phase('switch'):
+            with trace.span('http', 'PUT /api/publish/x/y') as record:
+                record.status = 200
+        with trace.span('command', 'aptly snapshot drop', ['x']):
+            pass
+    with trace.span('command', 'aptly db cleanup', ['db', 'cleanup']):
+        pass
+
+    put, drop, cleanup = tracer.operations()
+    assert (put.phase, put.alias, put.status) == \
+        ('switch', 'test-distro', 200)
+    assert (drop.phase, drop.alias) == ('publish', 'test-distro')
+    assert (cleanup.phase, cleanup.alias) == (None, None)
+    assert [r.name for r in tracer.records if r.kind == 'phase'] == \
+        ['switch', 'publish']
+
+
+def test_trace_aptly_commands(tracer, monkeypatch):
+    monkeypatch.setattr(subprocess, 'run', lambda args, **kwargs:
+                        subprocess.CompletedProcess(args, 0, b'sw1\nsw2\n'))
+    aptly = Aptly()
+    with trace.phase('update', 'sw1'):
+        aptly.get_raw_list('mirror')
+
+    record, = tracer.operations()
+    assert record.name == 'aptly mirror list'
+    assert record.label == 'aptly mirror list -raw'
+    assert (record.status, record.size) == (0, 8)
+    assert (record.phase, record.alias) == ('update', 'sw1')
+
+
+def test_chrome_trace_and_summary(tracer, tmp_path):
+    with trace.phase('update', 'sw1'):
+        with trace.span('command', 'aptly mirror update',
+                        ['mirror', 'update', 'sw1']) as record:
+            record.status = 0
+    tracer.write(str(tmp_path / 'trace.json'))
+
+    with open(str(tmp_path / 'trace.json')) as f:
+        events = json.load(f)['traceEvents']
+    assert [(e['name'], e['cat'], e['ph']) for e in events] == [
+        ('update', 'phase', 'X'), ('aptly mirror update', 'command', 'X')]
+    assert events[1]['args']['alias'] == 'sw1'
+    assert events[1]['args']['args'] == ['mirror', 'update', 'sw1']
+
+    header, row = tracer.summary().splitlines()
+    assert header.split() == ['seconds', 'phase', 'alias', 'status',
+                              'operation']
+    assert row.split()[1:] == ['update', 'sw1', '0',
+                               'aptly', 'mirror', 'update', 'sw1']
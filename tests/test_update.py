@@ -1,7 +1,14 @@
+import pytest
+import requests
+
+
 class Namespace():
     def __init__(self, target):
         self.target = target
         self.cron = True
+        self.jobs = 1
+        self.jobs_per_host = 2
+        self.order = None
 
 
 # mirror
@@ -74,6 +81,43 @@ def test_update_mirror_with_diff(app, aptly):
     assert aptly.pending_ops == []
 
 
+def test_skip_snapshot_of_unchanged_mirror(app, aptly):
+    aptly.register_mirror('test', snapshots=[1])
+    aptly.mirror_states['test'] = 'state1'
+    aptly.snapshot_states['test+r1'] = 'state1'
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source: !mirror test''')
+
+    aptly.schedule('mirror_update', 'test', True)
+
+    app.exec_update(Namespace(['test']))
+    assert aptly.pending_ops == []
+
+
+def test_remember_state_of_changed_mirror(app, aptly):
+    aptly.register_mirror('test', snapshots=[1])
+    aptly.mirror_states['test'] = 'state2'
+    aptly.snapshot_states['test+r1'] = 'state1'
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        component: main
+        source: !mirror test''')
+
+    aptly.schedule('mirror_update', 'test', True)
+    aptly.schedule('snapshot_mirror', 'test+r2', 'test')
+    aptly.schedule('snapshot_diff', 'test+r1', 'test+r2', ret='Diff!')
+
+    app.exec_update(Namespace(['test']))
+    assert aptly.pending_ops == []
+    assert aptly.snapshot_states['test+r2'] == 'state2'
+
+
 # repo
 
 
@@ -124,3 +168,173 @@ def test_update_repo_with_diff(app, aptly):
 
     app.exec_update(Namespace(['test']))
     assert aptly.pending_ops == []
+
+
+# parallel
+
+
+def test_update_in_parallel(app, aptly, capfd):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.register_repo('pkgs', snapshots=[1])
+    aptly.unordered = True
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        source:
+          - !mirror sw1
+          - !mirror sw2
+          - !repo pkgs''')
+
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('snapshot_mirror', 'sw1+r2', 'sw1')
+    aptly.schedule('snapshot_diff', 'sw1+r1', 'sw1+r2', ret='Diff sw1!')
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret=False)
+    aptly.schedule('snapshot_drop', 'sw2+r2', True)
+    aptly.schedule('snapshot_repo', 'pkgs+r2', 'pkgs')
+    aptly.schedule('snapshot_diff', 'pkgs+r1', 'pkgs+r2', ret='Diff pkgs!')
+
+    args = Namespace(['*'])
+    args.jobs = 3
+    args.jobs_per_host = 1
+    app.exec_update(args)
+    assert aptly.pending_ops == []
+
+    out, err = capfd.readouterr()
+    assert 'sw1\n---\nDiff sw1!\n' in out
+    assert 'pkgs\n----\nDiff pkgs!\n' in out
+    assert 'sw2' not in out
+
+
+def test_parallel_update_reports_api_errors(app, aptly, capfd):
+    aptly.register_mirror('sw1', snapshots=[1])
+    aptly.register_mirror('sw2', snapshots=[1])
+    aptly.unordered = True
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        source:
+          - !mirror sw1
+          - !mirror sw2''')
+
+    def snapshot_mirror(snapshot, mirror):
+        if mirror == 'sw1':
+            response = requests.Response()
+            response.status_code = 409
+            response._content = b'snapshot sw1+r2 already exists'
+            raise requests.HTTPError('409 Conflict', response=response)
+        return aptly.run('snapshot_mirror', snapshot, mirror)
+    aptly.snapshot_mirror = snapshot_mirror
+
+    aptly.schedule('mirror_update', 'sw1', True)
+    aptly.schedule('mirror_update', 'sw2', True)
+    aptly.schedule('snapshot_mirror', 'sw2+r2', 'sw2')
+    aptly.schedule('snapshot_diff', 'sw2+r1', 'sw2+r2', ret='Diff sw2!')
+
+    args = Namespace(['*'])
+    args.jobs = 2
+    with pytest.raises(requests.HTTPError):
+        app.exec_update(args)
+
+    out, err = capfd.readouterr()
+    assert 'sw2\n---\nDiff sw2!\n' in out
+    assert 'sw1\n---\nUpdate failed: 409 Conflict\n' \
+        'snapshot sw1+r2 already exists\n' in out
+
+
+# order
+
+
+def test_update_shortest_expected_first(app, aptly):
+    aptly.register_mirror('big', snapshots=[1])
+    aptly.register_mirror('new')
+    aptly.register_mirror('small', snapshots=[1])
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        components:
+          a: !mirror big
+          b: !mirror new
+          c: !mirror small''')
+    app.expected = {'big': 300.0, 'small': 2.5}
+
+    for name in ('small', 'big'):
+        aptly.schedule('mirror_update', name, True)
+        aptly.schedule('snapshot_mirror', f'{name}+r2', name)
+        aptly.schedule('snapshot_diff', f'{name}+r1', f'{name}+r2', ret=False)
+        aptly.schedule('snapshot_drop', f'{name}+r2', True)
+    aptly.schedule('mirror_update', 'new', True)  # unknown: longest
+    aptly.schedule('snapshot_mirror', 'new+r1', 'new')
+    aptly.schedule('snapshot_info', 'new+r1', ret='Empty')
+
+    args = Namespace([])
+    args.order = 'shortest'
+    app.exec_update(args)
+    assert aptly.pending_ops == []
+
+    assert [s.name for s in app._ordered(
+        app._update_targets(Namespace([])), args)] == ['small', 'big', 'new']
+    args.order = 'longest'
+    assert [s.name for s in app._update_targets(args)] == \
+        ['new', 'big', 'small']
+
+
+def test_history_read_only_for_duration_orders(app, aptly):
+    aptly.register_mirror('big', snapshots=[1])
+    aptly.register_mirror('small', snapshots=[1])
+    app.load('''publish:
+      - alias: 'test-distro'
+        destination: s3:apt:mon
+        distribution: distro
+        components:
+          a: !mirror big
+          b: !mirror small''')
+
+    class History():
+        reads = 0
+
+        def expected_durations(self):
+            self.reads += 1
+            return {'big': 300.0, 'small': 2.5}
+    app.history = History()
+
+    args = Namespace([])
+    assert [s.name for s in app._update_targets(args)] == ['big', 'small']
+    args.order = 'priority'
+    app._update_targets(args)
+    assert app.history.reads == 0
+    args.order = 'shortest'
+    assert [s.name for s in app._update_targets(args)] == ['small', 'big']
+    args.order = 'longest'
+    app._update_targets(args)
+    assert app.history.reads == 1
+
+
+def test_update_by_configured_priority(app, aptly):
+    aptly.register_mirror('a')
+    aptly.register_mirror('b')
+    aptly.register_mirror('c')
+    app.load('''update:
+  order: priority
+  priority:
+    c: 10
+    a: -1
+publish:
+  - alias: 'test-distro'
+    destination: s3:apt:mon
+    distribution: distro
+    components:
+      a: !mirror a
+      b: !mirror b
+      c: !mirror c''')
+
+    assert [s.name for s in app._update_targets(Namespace([]))] == \
+        ['c', 'b', 'a']
+    args = Namespace([])
+    args.order = 'config'
+    assert [s.name for s in app._update_targets(args)] == ['a', 'b', 'c']